@@ -0,0 +1,152 @@
+import json
+import os
+import platform
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from benchmarks.seed import seed
+from benchmarks.suite import run_suite
+
+
+class DisableMigrations:
+    """MIGRATION_MODULES value creating every table straight from the models"""
+
+    def __contains__(self, item):
+        return True
+
+    def __getitem__(self, item):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database (test database of the configured engine: in-memory SQLite '
+        'or test_<name> on Postgres) and benchmark the calculator, exporter and dashboard'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales',
+            type=str,
+            default='100,1000,10000',
+            help='Comma-separated portfolio sizes to benchmark (default: 100,1000,10000)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Runs per benchmark (default: 3)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Seed of the synthetic data set (default: 42)',
+        )
+        parser.add_argument(
+            '--only',
+            type=str,
+            help='Comma-separated substrings selecting benchmarks (e.g. calculator,dashboard_charts)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='JSON results file (default: benchmarks/results/<timestamp>-<commit>.json)',
+        )
+        parser.add_argument(
+            '--compare',
+            type=str,
+            help='Previous JSON results file to compare medians against',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            scales = sorted(int(scale) for scale in options['scales'].split(',') if scale.strip())
+        except ValueError:
+            raise CommandError(f"Invalid --scales value: {options['scales']}")
+        if not scales or scales[0] < 1 or options['repeat'] < 1:
+            raise CommandError('--scales and --repeat must be positive')
+        selected = [name.strip() for name in options['only'].split(',')] if options['only'] else None
+
+        commit = self.git_commit()
+        results = []
+        with override_settings(MIGRATION_MODULES=DisableMigrations()):
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for scale in scales:
+                started = time.perf_counter()
+                seed(scale, options['seed'])
+                self.stdout.write(f'Seeded {scale} projects in {time.perf_counter() - started:.1f}s')
+
+                for result in run_suite(scale, options['repeat'], selected):
+                    results.append(result)
+                    self.stdout.write(
+                        f"  {result['benchmark']:<50} median {result['median_ms']:>10.1f} ms "
+                        f"({result['per_call_ms']:.1f} ms/call, {result['queries']} queries)"
+                    )
+            vendor = connection.vendor
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks', 'results',
+            f"{timezone.now().strftime('%Y%m%d-%H%M%S')}-{commit or 'nogit'}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': commit,
+                    'created_at': timezone.now().isoformat(),
+                    'database': vendor,
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'seed': options['seed'],
+                    'repeat': options['repeat'],
+                    'scales': scales,
+                },
+                'results': results,
+            }, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def git_commit(self):
+        """Short hash of the checked out commit, if this is a git checkout"""
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+
+    def compare(self, path, results):
+        """Print the median change of each benchmark against a previous results file"""
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+
+        baseline = {(r['scale'], r['benchmark']): r for r in previous.get('results', [])}
+        self.stdout.write(f"Compared with {path} (commit {previous.get('meta', {}).get('commit') or '?'}):")
+        for result in results:
+            before = baseline.get((result['scale'], result['benchmark']))
+            if before is None or not before['median_ms']:
+                continue
+            change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+            line = (
+                f"  [{result['scale']}] {result['benchmark']:<50} "
+                f"{before['median_ms']:>10.1f} -> {result['median_ms']:>10.1f} ms ({change:+.1f}%)"
+            )
+            style = self.style.ERROR if change > 10 else self.style.SUCCESS if change < -10 else str
+            self.stdout.write(style(line))
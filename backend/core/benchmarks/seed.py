@@ -0,0 +1,151 @@
+"""
+Deterministic synthetic catalog and project portfolio for the benchmark suite.
+
+The same seed always produces the same catalog, users and projects, so timings
+from different commits are measured against identical data.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from accounts.models import User
+from materials.models import Category, Material
+from projects.models import Project
+from calculations.models import ProjectItem
+from calculations.services import MaterialManager, ProjectCalculator, build_budget_breakdown
+
+
+# Smart materials added on top of the default catalog: (calculation type, conditions)
+SMART_MATERIAL_RULES = [
+    ('PER_USER', {}),
+    ('PER_SERVER', {}),
+    ('PER_PC', {}),
+    ('PER_DEVICE', {}),
+    ('PER_SWITCH', {}),
+    ('PER_PROJECT', {}),
+    ('FIXED', {}),
+    ('CONDITIONAL', {'min_users': 100}),
+    ('CONDITIONAL', {'has_file_server': True, 'max_users': 500}),
+    ('CONDITIONAL', {'has_videoconference': True}),
+]
+SMART_MATERIALS_PER_RULE = 4
+
+INTERNET_LINES = [('FO', '100MBps'), ('FO', '1GBps'), ('STARLINK', '500MBps'), ('VSAT', '20MBps')]
+
+BENCHMARK_USERS = 10
+
+
+def seed_catalog(rng):
+    """Default categories and materials plus synthetic smart materials and internet lines"""
+    MaterialManager.create_default_categories()
+    MaterialManager.create_default_materials()
+
+    services, _ = Category.objects.get_or_create(name='Services')
+    licenses, _ = Category.objects.get_or_create(name='Software Licenses')
+    for line_type, speed in INTERNET_LINES:
+        name = f"{'Fiber Optic' if line_type == 'FO' else line_type} {speed}"
+        Material.objects.get_or_create(name=name, defaults={
+            'category': services,
+            'price_france': Decimal('250.00'),
+            'price_morocco': Decimal('2700.00'),
+            'calculation_type': 'FIXED',
+        })
+
+    for rule_index, (calculation_type, conditions) in enumerate(SMART_MATERIAL_RULES):
+        for copy_index in range(SMART_MATERIALS_PER_RULE):
+            price = Decimal(rng.randint(5, 900))
+            Material.objects.get_or_create(
+                name=f'Benchmark {calculation_type.lower()} {rule_index}-{copy_index}',
+                defaults={
+                    'category': licenses if copy_index % 2 else services,
+                    'price_france': price,
+                    'price_morocco': price * Decimal('10.80'),
+                    'calculation_type': calculation_type,
+                    'multiplier': Decimal(rng.choice(['0.25', '0.50', '1.00', '1.50', '2.00'])),
+                    'min_quantity': rng.choice([0, 0, 1, 5]),
+                    'max_quantity': rng.choice([999999, 999999, 50]),
+                    'conditions': conditions,
+                },
+            )
+
+
+def seed_users():
+    users = []
+    for index in range(BENCHMARK_USERS):
+        user, _ = User.objects.get_or_create(
+            username=f'benchmark-{index}',
+            defaults={'role': 'admin' if index == 0 else 'user', 'is_staff': index == 0},
+        )
+        users.append(user)
+    return users
+
+
+def build_project(seed_value, index, users, now):
+    # One random stream per project: growing 100 -> 1000 yields the same data as seeding 1000
+    rng = random.Random(f'{seed_value}-project-{index}')
+    users_count = rng.choice([5, 12, 25, 40, 60, 90, 120, 180, 250, 400, 800])
+    laptops = rng.randint(0, users_count)
+    line_type, speed = rng.choice(INTERNET_LINES)
+    return Project(
+        name=f'Benchmark project {index}',
+        entity=rng.choice(Project.Entity.values),
+        number_of_users=users_count,
+        num_laptop_office=laptops,
+        num_laptop_tech=rng.randint(0, max(1, users_count // 10)),
+        num_desktop_office=max(0, users_count - laptops),
+        num_desktop_tech=rng.randint(0, max(1, users_count // 20)),
+        num_printers=rng.randint(0, 6),
+        num_traceau=rng.randint(0, 2),
+        num_videoconference=rng.randint(0, 3),
+        num_aps=rng.randint(0, 10),
+        local_apps=rng.random() < 0.4,
+        file_server=rng.random() < 0.6,
+        site_addresses=', '.join(f'Site {site}' for site in range(rng.randint(1, 3))),
+        internet_line_type=line_type,
+        internet_line_speed=speed,
+        status=rng.choice(Project.Status.values),
+        priority=rng.choice(Project.Priority.values),
+        progress=rng.randint(0, 100),
+        created_by=users[index % len(users)],
+        created_at=now - timedelta(days=rng.randint(0, 540)),
+    )
+
+
+def seed_projects(seed_value, users, target_count, batch_size=500):
+    """
+    Grow the portfolio to target_count projects, with stored budgets.
+
+    Projects and their ProjectItem rows are bulk inserted; budgets come from
+    the vectorized ProjectCalculator.get_plans() pass.
+    """
+    existing = Project.objects.count()
+    now = timezone.now()
+    calculator = ProjectCalculator()
+
+    for start in range(existing, target_count, batch_size):
+        projects = Project.objects.bulk_create([
+            build_project(seed_value, index, users, now)
+            for index in range(start, min(start + batch_size, target_count))
+        ])
+        plans = calculator.get_plans(projects)
+
+        items = []
+        for project, plan in zip(projects, plans):
+            for item_data in plan.project_items:
+                items.append(calculator._build_project_item(project, item_data))
+            project.total_cost_france = plan.total_france
+            project.total_cost_morocco = plan.total_morocco
+            project.budget_breakdown = build_budget_breakdown(plan.project_items)
+        ProjectItem.objects.bulk_create(items)
+        Project.objects.bulk_update(projects, ['total_cost_france', 'total_cost_morocco', 'budget_breakdown'])
+
+
+def seed(target_count, seed_value=42):
+    """Seed (or grow) the benchmark data set up to target_count projects"""
+    rng = random.Random(f'{seed_value}-catalog')
+    if not Material.objects.exists():
+        seed_catalog(rng)
+    users = seed_users()
+    seed_projects(seed_value, users, target_count)
@@ -0,0 +1,131 @@
+"""
+Benchmarks of the budget calculator, the Excel exporter and the dashboard views.
+
+Each benchmark is a callable run `repeat` times against the seeded data set;
+wall time and database query counts are recorded per run.
+"""
+import contextlib
+import io
+import statistics
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from projects.models import Project
+from projects.exporters import ExcelExporter
+from projects.portfolio import write_portfolio
+from calculations.services import ProjectCalculator
+from dashboard.views import DashboardChartsView, DashboardStatsView
+
+
+# Projects sampled by the per-project benchmarks
+SAMPLE_SIZE = 20
+EXPORT_SAMPLE_SIZE = 5
+
+CHART_METHODS = [
+    'get_monthly_revenue_data',
+    'get_equipment_usage_trends',
+    'get_cost_analysis_by_category',
+    'get_project_complexity_analysis',
+    'get_project_status_data',
+    'get_user_registration_trends',
+    'get_material_category_data',
+]
+
+
+def sample_projects(size):
+    """Evenly spaced projects across the portfolio, stable for a given data set"""
+    ids = list(Project.objects.order_by('pk').values_list('pk', flat=True))
+    step = max(1, len(ids) // size)
+    return list(Project.objects.filter(pk__in=ids[::step][:size]).order_by('pk'))
+
+
+def bench_calculate_budget(samples):
+    # A fresh calculator per project: no memoized catalog or plans
+    for project in samples['projects']:
+        ProjectCalculator().calculate_budget(project)
+
+
+def bench_save_project_budget(samples):
+    for project in samples['projects']:
+        ProjectCalculator().save_project_budget(project, force=True)
+
+
+def bench_generate_project_excel(samples):
+    exporter = ExcelExporter()
+    for project in samples['export_projects']:
+        exporter.generate_project_excel(project)
+
+
+def bench_generate_project_excel_write_only(samples):
+    exporter = ExcelExporter(write_only=True)
+    for project in samples['export_projects']:
+        exporter.generate_project_excel(project, io.BytesIO())
+
+
+def bench_portfolio_workbook(samples):
+    # In-process, so that the queries of the whole export are counted
+    write_portfolio(samples['projects'], io.BytesIO(), workers=1)
+
+
+def bench_dashboard_stats(samples):
+    DashboardStatsView().calculate_dashboard_stats()
+
+
+def chart_benchmark(method_name):
+    def bench(samples):
+        getattr(DashboardChartsView(), method_name)()
+    return bench
+
+
+BENCHMARKS = [
+    ('calculator.calculate_budget', bench_calculate_budget, SAMPLE_SIZE),
+    ('calculator.save_project_budget', bench_save_project_budget, SAMPLE_SIZE),
+    ('exporter.generate_project_excel', bench_generate_project_excel, EXPORT_SAMPLE_SIZE),
+    ('exporter.generate_project_excel_write_only', bench_generate_project_excel_write_only, EXPORT_SAMPLE_SIZE),
+    ('exporter.portfolio_workbook', bench_portfolio_workbook, 1),
+    ('dashboard.calculate_dashboard_stats', bench_dashboard_stats, 1),
+] + [
+    (f'dashboard_charts.{method_name}', chart_benchmark(method_name), 1)
+    for method_name in CHART_METHODS
+]
+
+
+def run_benchmark(function, samples, repeat):
+    """Run a benchmark `repeat` times; returns per-run seconds and query counts"""
+    seconds = []
+    queries = []
+    for _ in range(repeat):
+        # The dashboard views print progress; keep it out of the results
+        with contextlib.redirect_stdout(io.StringIO()), CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            function(samples)
+            seconds.append(time.perf_counter() - started)
+        queries.append(len(context.captured_queries))
+    return seconds, queries
+
+
+def run_suite(scale, repeat, selected=None):
+    """Run all (or the selected) benchmarks at one scale; returns result dicts"""
+    samples = {
+        'projects': sample_projects(SAMPLE_SIZE),
+        'export_projects': sample_projects(EXPORT_SAMPLE_SIZE),
+    }
+    results = []
+    for name, function, calls in BENCHMARKS:
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        seconds, queries = run_benchmark(function, samples, repeat)
+        results.append({
+            'scale': scale,
+            'benchmark': name,
+            'calls_per_run': calls,
+            'runs': repeat,
+            'min_ms': round(min(seconds) * 1000, 3),
+            'median_ms': round(statistics.median(seconds) * 1000, 3),
+            'mean_ms': round(statistics.mean(seconds) * 1000, 3),
+            'per_call_ms': round(statistics.median(seconds) * 1000 / calls, 3),
+            'queries': max(queries),
+        })
+    return results
@@ -0,0 +1,206 @@
+import numpy as np
+from decimal import Decimal
+
+from materials.conditions import compile_conditions
+
+
+# Columns of the project feature matrix
+FEATURES = [
+    'users',            # number_of_users
+    'pcs',              # laptops + desktops
+    'laptops',          # office + tech laptops
+    'office_pcs',       # office laptops + office desktops (used by the 'min_servers' condition)
+    'servers',          # file server + application server
+    'switches',         # 2 x 24 ports + users x 1.5 / 48 x 48 ports
+    'traceau',          # num_traceau
+    'videoconference',  # num_videoconference
+    'local_apps',       # 0/1
+    'file_server',      # 0/1
+    'one',              # constant column for fixed quantities
+]
+F = {name: index for index, name in enumerate(FEATURES)}
+
+# Feature column of each condition variable (see materials.conditions)
+CONDITION_FEATURES = {
+    'users': 'users',
+    'office_pcs': 'office_pcs',
+    'videoconference': 'videoconference',
+    'file_server': 'file_server',
+    'local_apps': 'local_apps',
+}
+
+# Internet line types as they appear in material names
+INTERNET_TYPE_MAPPING = {
+    'FO': 'Fiber Optic',
+    'STARLINK': 'STARLINK',
+    'VSAT': 'VSAT'
+}
+INTERNET_TYPES = ['Fiber Optic', 'STARLINK', 'VSAT']
+
+# Calculation types whose materials are still evaluated when another item group already produced them
+OVERRIDING_CALCULATION_TYPES = ['PER_USER', 'PER_SERVER', 'PER_PC', 'PER_DEVICE']
+
+
+def _to_cents(value):
+    """Exact integer number of hundredths for a 2-decimal value"""
+    return int((Decimal(value or 0) * 100).to_integral_value())
+
+
+def is_internet_service(material_name):
+    """Check if a material is an internet service"""
+    return any(internet_type in material_name for internet_type in INTERNET_TYPES)
+
+
+def selected_internet_service(project):
+    """Name fragment of the internet service selected for a project"""
+    full_type = INTERNET_TYPE_MAPPING.get(project.internet_line_type, project.internet_line_type)
+    return f"{full_type} {project.internet_line_speed}"
+
+
+class QuantityEngine:
+    """
+    Vectorized evaluation of the smart calculation rules.
+
+    Builds a rule matrix for M materials once, then evaluates any number of
+    projects at once: a feature matrix (N x F) is built for the projects and
+    the full N x M quantity and cost matrices are computed with NumPy.
+    Quantities are computed in integer hundredths so results are identical
+    to ProjectCalculator._calculate_material_quantity.
+    """
+
+    def __init__(self, materials):
+        self.materials = list(materials)
+        self.names = [material.name for material in self.materials]
+        m = len(self.materials)
+
+        # Rule matrix: source feature, multiplier, limits and pricing, one column per material
+        self.source = np.full(m, F['one'], dtype=np.int64)
+        self.multiplier = np.array([_to_cents(material.multiplier) for material in self.materials], dtype=np.int64)
+        self.min_quantity = np.array([material.min_quantity for material in self.materials], dtype=np.int64)
+        self.max_quantity = np.array([material.max_quantity for material in self.materials], dtype=np.int64)
+        self.price_france = np.array([_to_cents(material.price_france) for material in self.materials], dtype=np.int64)
+        self.price_morocco = np.array([_to_cents(material.price_morocco) for material in self.materials], dtype=np.int64)
+        self.overrides = np.array(
+            [material.calculation_type in OVERRIDING_CALCULATION_TYPES for material in self.materials], dtype=bool
+        )
+
+        # Materials gated per project: internet services and CONDITIONAL materials
+        self.internet = np.zeros(m, dtype=bool)
+        self.conditions = []
+
+        for index, material in enumerate(self.materials):
+            calculation_type = material.calculation_type
+            if calculation_type == 'PER_USER':
+                self.source[index] = F['users']
+            elif calculation_type == 'PER_SERVER':
+                self.source[index] = F['servers']
+            elif calculation_type == 'PER_PC':
+                self.source[index] = F['pcs']
+            elif calculation_type == 'PER_DEVICE':
+                # Special case for Docking Station - only count laptops
+                self.source[index] = F['laptops'] if material.name == 'Docking Station' else F['pcs']
+            elif calculation_type == 'PER_SWITCH':
+                self.source[index] = F['switches']
+            elif calculation_type == 'FIXED':
+                if is_internet_service(material.name):
+                    self.internet[index] = True
+                elif material.name == 'Traceur A0':
+                    self.source[index] = F['traceau']
+                elif material.name == 'Application server':
+                    self.source[index] = F['local_apps']
+            elif calculation_type == 'CONDITIONAL':
+                conditions = compile_conditions(material.conditions)
+                if conditions.predicates:
+                    self.conditions.append((index, conditions))
+
+    @staticmethod
+    def feature_matrix(projects):
+        """Build the N x F feature matrix for a sequence of projects"""
+        features = np.zeros((len(projects), len(FEATURES)), dtype=np.int64)
+        for row, project in enumerate(projects):
+            laptops = project.num_laptop_office + project.num_laptop_tech
+            users = project.number_of_users
+            features[row] = (
+                users,
+                laptops + project.num_desktop_office + project.num_desktop_tech,
+                laptops,
+                project.num_laptop_office + project.num_desktop_office,
+                int(bool(project.file_server)) + int(bool(project.local_apps)),
+                2 + max(0, (users * 3) // 96),
+                project.num_traceau,
+                project.num_videoconference,
+                int(bool(project.local_apps)),
+                int(bool(project.file_server)),
+                1,
+            )
+        return features
+
+    def condition_mask(self, features):
+        """N x M mask of CONDITIONAL materials whose conditions hold (True elsewhere)"""
+        mask = np.ones((features.shape[0], len(self.materials)), dtype=bool)
+        arrays = {name: features[:, F[column]] for name, column in CONDITION_FEATURES.items()}
+        for index, conditions in self.conditions:
+            mask[:, index] = conditions.evaluate_many(arrays)
+        return mask
+
+    def internet_mask(self, projects):
+        """N x M mask of internet services selected by each project (True for other materials)"""
+        mask = np.ones((len(projects), len(self.materials)), dtype=bool)
+        internet_indexes = np.flatnonzero(self.internet)
+        if not len(internet_indexes):
+            return mask
+
+        # Few distinct selections exist, so match names once per selection
+        rows_by_selection = {}
+        for row, project in enumerate(projects):
+            rows_by_selection.setdefault(selected_internet_service(project), []).append(row)
+
+        for selection, rows in rows_by_selection.items():
+            selected = np.array([selection in self.names[index] for index in internet_indexes], dtype=bool)
+            mask[np.ix_(rows, internet_indexes)] = selected
+        return mask
+
+    def quantities(self, projects, features=None):
+        """N x M integer quantity matrix"""
+        if features is None:
+            features = self.feature_matrix(projects)
+
+        base = features[:, self.source]
+        base = base * (self.condition_mask(features) & self.internet_mask(projects))
+
+        # Work in hundredths of a unit, then clamp and truncate like int(Decimal)
+        quantity = base * self.multiplier
+        quantity = np.maximum(self.min_quantity * 100, np.minimum(quantity, self.max_quantity * 100))
+        return np.sign(quantity) * (np.abs(quantity) // 100)
+
+    def evaluate(self, projects):
+        """
+        Return (quantities, cost_france, cost_morocco) N x M matrices.
+        Costs are in integer cents.
+        """
+        quantity = self.quantities(projects)
+        return quantity, quantity * self.price_france, quantity * self.price_morocco
+
+    def custom_items(self, projects, previous_items, quantity=None):
+        """
+        Per-project {material name: quantity} dicts, matching calculate_custom_materials.
+
+        previous_items holds, for each project, the names already produced by
+        the user, automatic and service item groups.
+        """
+        if quantity is None:
+            quantity = self.quantities(projects)
+
+        name_index = {name: index for index, name in enumerate(self.names)}
+        included = quantity > 0
+        for row, names in enumerate(previous_items):
+            for name in names:
+                index = name_index.get(name)
+                if index is not None and not self.overrides[index]:
+                    included[row, index] = False
+
+        results = []
+        for row in range(len(projects)):
+            columns = np.flatnonzero(included[row])
+            results.append({self.names[index]: int(quantity[row, index]) for index in columns})
+        return results
@@ -0,0 +1,253 @@
+import ast
+import math
+
+import numpy as np
+
+
+class ExpressionError(ValueError):
+    """Raised when a formula is not a valid, allowed expression"""
+
+
+# Variables available to formulas, with the project fields each one reads
+FORMULA_VARIABLES = {
+    'users': ['number_of_users'],
+    'sites': ['site_addresses'],
+    'laptops': ['num_laptop_office', 'num_laptop_tech'],
+    'desktops': ['num_desktop_office', 'num_desktop_tech'],
+    'pcs': ['num_laptop_office', 'num_laptop_tech', 'num_desktop_office', 'num_desktop_tech'],
+    'laptop_office': ['num_laptop_office'],
+    'laptop_tech': ['num_laptop_tech'],
+    'desktop_office': ['num_desktop_office'],
+    'desktop_tech': ['num_desktop_tech'],
+    'printers': ['num_printers'],
+    'traceau': ['num_traceau'],
+    'videoconference': ['num_videoconference'],
+    'aps': ['num_aps'],
+    'total_devices': [
+        'num_laptop_office', 'num_laptop_tech', 'num_desktop_office', 'num_desktop_tech',
+        'num_printers', 'num_aps', 'num_traceau', 'num_videoconference',
+    ],
+    'servers': ['file_server', 'local_apps'],
+    'local_apps': ['local_apps'],
+    'file_server': ['file_server'],
+}
+
+# Scalar and vectorized implementations of the allowed functions
+FUNCTIONS = {
+    'min': (min, lambda *args: np.minimum.reduce(np.broadcast_arrays(*args))),
+    'max': (max, lambda *args: np.maximum.reduce(np.broadcast_arrays(*args))),
+    'abs': (abs, np.abs),
+    'int': (int, np.trunc),
+    'round': (round, np.round),
+    'ceil': (math.ceil, np.ceil),
+    'floor': (math.floor, np.floor),
+}
+
+BINARY_OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b,
+}
+
+COMPARE_OPERATORS = {
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+}
+
+MAX_FORMULA_LENGTH = 500
+
+
+def project_variables(project):
+    """Formula variables of one project"""
+    laptops = project.num_laptop_office + project.num_laptop_tech
+    desktops = project.num_desktop_office + project.num_desktop_tech
+    return {
+        'users': project.number_of_users,
+        'sites': project.number_of_sites,
+        'laptops': laptops,
+        'desktops': desktops,
+        'pcs': laptops + desktops,
+        'laptop_office': project.num_laptop_office,
+        'laptop_tech': project.num_laptop_tech,
+        'desktop_office': project.num_desktop_office,
+        'desktop_tech': project.num_desktop_tech,
+        'printers': project.num_printers,
+        'traceau': project.num_traceau,
+        'videoconference': project.num_videoconference,
+        'aps': project.num_aps,
+        'total_devices': project.total_devices,
+        'servers': int(bool(project.file_server)) + int(bool(project.local_apps)),
+        'local_apps': int(bool(project.local_apps)),
+        'file_server': int(bool(project.file_server)),
+    }
+
+
+def project_variable_arrays(projects):
+    """
+    Formula variables of many projects, as one array per variable.
+
+    Arrays are float64 so that a division by zero yields inf/nan instead of
+    silently returning 0 like integer NumPy division does.
+    """
+    rows = [project_variables(project) for project in projects]
+    return {
+        name: np.array([row[name] for row in rows], dtype=np.float64)
+        for name in FORMULA_VARIABLES
+    }
+
+
+class CompiledExpression:
+    """
+    A formula parsed once into a restricted AST.
+
+    Only arithmetic, comparisons, boolean operators, conditional expressions,
+    integer/float literals, the FORMULA_VARIABLES and the FUNCTIONS (also as
+    math.ceil / math.floor) are allowed. The expression is then evaluated
+    either for one project (evaluate) or for arrays of projects (evaluate_many).
+    """
+
+    def __init__(self, source):
+        self.source = source
+        if len(source) > MAX_FORMULA_LENGTH:
+            raise ExpressionError(f'Formula is longer than {MAX_FORMULA_LENGTH} characters')
+        try:
+            tree = ast.parse(source.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ExpressionError(f'Invalid formula syntax: {e.msg}')
+
+        self.variables = set()
+        self._scalar = self._compile(tree.body, vectorized=False)
+        self._vectorized = self._compile(tree.body, vectorized=True)
+
+    @property
+    def fields(self):
+        """Project fields read by the formula"""
+        return {field for name in self.variables for field in FORMULA_VARIABLES[name]}
+
+    def evaluate(self, variables):
+        """Evaluate for one project, given its project_variables() dict"""
+        return self._scalar(variables)
+
+    def evaluate_many(self, variables):
+        """Evaluate for many projects, given project_variable_arrays(); returns a float array"""
+        size = len(next(iter(variables.values()))) if variables else 0
+        return np.broadcast_to(self._vectorized(variables), (size,))
+
+    def _compile(self, node, vectorized):
+        """Translate an AST node into a closure, rejecting anything not allowed"""
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise ExpressionError(f'Unsupported constant: {node.value!r}')
+            value = node.value
+            return lambda variables: value
+
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name not in FORMULA_VARIABLES:
+                raise ExpressionError(f'Unknown variable: {name}')
+            self.variables.add(name)
+            return lambda variables: variables[name]
+
+        if isinstance(node, ast.BinOp):
+            operator = BINARY_OPERATORS.get(type(node.op))
+            if operator is None:
+                raise ExpressionError(f'Unsupported operator: {type(node.op).__name__}')
+            left = self._compile(node.left, vectorized)
+            right = self._compile(node.right, vectorized)
+            return lambda variables: operator(left(variables), right(variables))
+
+        if isinstance(node, ast.UnaryOp):
+            operand = self._compile(node.operand, vectorized)
+            if isinstance(node.op, ast.USub):
+                return lambda variables: -operand(variables)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            if isinstance(node.op, ast.Not):
+                if vectorized:
+                    return lambda variables: np.logical_not(operand(variables))
+                return lambda variables: not operand(variables)
+            raise ExpressionError(f'Unsupported operator: {type(node.op).__name__}')
+
+        if isinstance(node, ast.Compare):
+            operators = []
+            for op in node.ops:
+                operator = COMPARE_OPERATORS.get(type(op))
+                if operator is None:
+                    raise ExpressionError(f'Unsupported comparison: {type(op).__name__}')
+                operators.append(operator)
+            operands = [self._compile(operand, vectorized) for operand in [node.left] + node.comparators]
+
+            def compare(variables):
+                values = [operand(variables) for operand in operands]
+                result = True
+                for operator, left, right in zip(operators, values, values[1:]):
+                    result = result & operator(left, right) if vectorized else result and operator(left, right)
+                return result
+            return compare
+
+        if isinstance(node, ast.BoolOp):
+            values = [self._compile(value, vectorized) for value in node.values]
+            is_and = isinstance(node.op, ast.And)
+            if vectorized:
+                combine = np.logical_and if is_and else np.logical_or
+                return lambda variables: combine.reduce(np.broadcast_arrays(*[value(variables) for value in values]))
+            if is_and:
+                return lambda variables: all(value(variables) for value in values)
+            return lambda variables: any(value(variables) for value in values)
+
+        if isinstance(node, ast.IfExp):
+            test = self._compile(node.test, vectorized)
+            body = self._compile(node.body, vectorized)
+            orelse = self._compile(node.orelse, vectorized)
+            if vectorized:
+                return lambda variables: np.where(test(variables), body(variables), orelse(variables))
+            return lambda variables: body(variables) if test(variables) else orelse(variables)
+
+        if isinstance(node, ast.Call):
+            if node.keywords:
+                raise ExpressionError('Keyword arguments are not allowed')
+            name = self._function_name(node.func)
+            scalar_function, vectorized_function = FUNCTIONS[name]
+            function = vectorized_function if vectorized else scalar_function
+            arguments = [self._compile(argument, vectorized) for argument in node.args]
+            if not arguments or (name not in ('min', 'max') and len(arguments) != 1):
+                raise ExpressionError(f'Wrong number of arguments for {name}()')
+            if name in ('min', 'max') and len(arguments) < 2:
+                raise ExpressionError(f'{name}() needs at least two arguments')
+            return lambda variables: function(*[argument(variables) for argument in arguments])
+
+        raise ExpressionError(f'Unsupported expression: {type(node).__name__}')
+
+    def _function_name(self, node):
+        """Name of an allowed function, written as name(...) or math.name(...)"""
+        if isinstance(node, ast.Name) and node.id in FUNCTIONS:
+            return node.id
+        if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and
+                node.value.id == 'math' and node.attr in ('ceil', 'floor')):
+            return node.attr
+        raise ExpressionError(f'Function not allowed: {ast.unparse(node)}')
+
+
+# Compiled formulas of CalculationRules, keyed by rule id and invalidated by updated_at
+_compiled_rules = {}
+
+
+def compile_expression(source):
+    """Parse and validate a formula, raising ExpressionError if it is not allowed"""
+    return CompiledExpression(source)
+
+
+def compile_rule(rule):
+    """Return the compiled formula of a CalculationRule, parsing it only when the rule changed"""
+    cached = _compiled_rules.get(rule.pk)
+    if cached is None or cached[0] != rule.updated_at:
+        cached = (rule.updated_at, compile_expression(rule.formula))
+        _compiled_rules[rule.pk] = cached
+    return cached[1]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculations', '0001_initial'),
+        ('projects', '0016_project_budget_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalculationTrace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=50)),
+                ('total_ms', models.FloatField()),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('query_ms', models.FloatField(default=0)),
+                ('stages', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='calculation_traces', to='projects.project')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
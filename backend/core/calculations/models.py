@@ -1,6 +1,8 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from projects.models import Project
-from materials.models import Material
+from materials.models import CatalogVersion, Material
 
 
 class ProjectItem(models.Model):
@@ -33,6 +35,13 @@ class ProjectItem(models.Model):
         self.total_cost_france = self.quantity * self.material.price_france
         self.total_cost_morocco = self.quantity * self.material.price_morocco
         super().save(*args, **kwargs)
+        # The materialized breakdown is rebuilt on the next read
+        Project.objects.filter(pk=self.project_id).update(budget_breakdown=None)
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        Project.objects.filter(pk=self.project_id).update(budget_breakdown=None)
+        return result
 
 
 class CalculationRule(models.Model):
@@ -50,4 +59,57 @@ class CalculationRule(models.Model):
     
     def __str__(self):
         return f"{self.name} -> {self.target_material.name}"
+    
+    def clean(self):
+        from calculations.expressions import ExpressionError, compile_expression
+        try:
+            compile_expression(self.formula)
+        except ExpressionError as e:
+            raise ValidationError({'formula': str(e)})
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Active rules change budgets like catalog changes do
+        CatalogVersion.bump()
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        CatalogVersion.bump()
+        return result
+
+
 
+class CalculationTrace(models.Model):
+    """Per-stage timing and query counts of one traced budget calculation (rolling log)"""
+    MAX_ROWS = 1000
+    
+    project = models.ForeignKey(Project, on_delete=models.SET_NULL, null=True, blank=True, related_name='calculation_traces')
+    action = models.CharField(max_length=50)
+    total_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    stages = models.JSONField(default=dict)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.action} - {self.project_id} ({self.total_ms:.1f} ms)"
+    
+    @classmethod
+    def record(cls, trace, action, project=None, user=None):
+        """Store a StageTracer.as_dict() result and drop rows beyond MAX_ROWS"""
+        entry = cls.objects.create(
+            project=project,
+            action=action,
+            total_ms=trace['total_ms'],
+            query_count=trace['queries'],
+            query_ms=trace['query_ms'],
+            stages=trace['stages'],
+            created_by=user if user is not None and user.is_authenticated else None,
+        )
+        stale = cls.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)[cls.MAX_ROWS:]
+        cls.objects.filter(pk__in=list(stale)).delete()
+        return entry
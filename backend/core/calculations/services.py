@@ -1,14 +1,338 @@
+import copy
+import hashlib
+import itertools
+import json
 import math
+import logging
+import numpy as np
 from decimal import Decimal
 from django.db import transaction
-from materials.models import Material, Category
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
+from materials.conditions import compile_conditions, project_condition_values
+from materials.models import CatalogVersion, Material, Category, PriceHistory, _quant2
 from projects.models import Project
-from calculations.models import ProjectItem
+from calculations.models import CalculationRule, ProjectItem
+from calculations.engine import QuantityEngine, _to_cents, is_internet_service
+from calculations.tracing import trace_stage
+from calculations.expressions import ExpressionError, compile_rule, project_variable_arrays, project_variables
+
+logger = logging.getLogger(__name__)
+
+SMART_CALCULATION_TYPES = [
+    'PER_USER', 'PER_SERVER', 'PER_PC', 'PER_DEVICE', 'PER_SWITCH', 'PER_PROJECT', 'FIXED', 'CONDITIONAL'
+]
+
+# ProjectItem columns written from a calculated budget line
+PROJECT_ITEM_COST_FIELDS = [
+    'quantity', 'is_auto_calculated',
+    'unit_cost_france', 'unit_cost_morocco', 'total_cost_france', 'total_cost_morocco',
+]
+
+
+# Project fields that feed the budget calculation; any other field (name, status, dates...)
+# can change without affecting costs
+COST_DRIVING_FIELDS = [
+    'number_of_users',
+    'num_laptop_office', 'num_laptop_tech', 'num_desktop_office', 'num_desktop_tech',
+    'num_printers', 'num_traceau', 'num_videoconference', 'num_aps',
+    'local_apps', 'file_server', 'internet_line_type', 'internet_line_speed',
+    # Read by CalculationRule formulas through the 'sites' variable
+    'site_addresses',
+]
+
+
+PC_FIELDS = ['num_laptop_office', 'num_laptop_tech', 'num_desktop_office', 'num_desktop_tech']
+INTERNET_FIELDS = ['internet_line_type', 'internet_line_speed']
+
+# Field-dependency graph: which cost-driving fields each rule reads. A change to a
+# field only re-evaluates the materials that depend on it, see update_project_budget().
+
+# Items produced by the user, automatic and service groups
+ITEM_DEPENDENCIES = {
+    'Laptop Bureautique': ['num_laptop_office'],
+    'Laptop Technique': ['num_laptop_tech'],
+    'Desktop Bureautique': ['num_desktop_office'],
+    'Desktop Technique': ['num_desktop_tech'],
+    'Imprimante': ['num_printers'],
+    'Traceur A0': ['num_traceau'],
+    'Standard visio system': ['num_videoconference'],
+    'Monitor': ['num_videoconference'],
+    'Access Point': ['num_aps', 'number_of_users'],
+    'Application server': ['local_apps'],
+    'File Server (Standard)': ['file_server'],
+    'Switch 48 Ports PoE': ['number_of_users'],
+    'Tranceiver RJ45': ['number_of_users'],
+    'DAC Cable': ['number_of_users'],
+    'Câble réseau blindé Cat 6 2 m': ['number_of_users'],
+    'Câble réseau blindé Cat 6 5 m': ['number_of_users'],
+    'Câble réseau blindé Cat 6 50cm': ['number_of_users'],
+    'SD-WAN MX67': ['number_of_users'],
+    'SD-WAN MX75': ['number_of_users'],
+    'SD-WAN MX95': ['number_of_users'],
+}
+
+# Smart calculation rules, by calculation type
+CALCULATION_TYPE_DEPENDENCIES = {
+    'PER_USER': ['number_of_users'],
+    'PER_SERVER': ['file_server', 'local_apps'],
+    'PER_PC': PC_FIELDS,
+    'PER_DEVICE': PC_FIELDS,
+    'PER_SWITCH': ['number_of_users'],
+    'PER_PROJECT': [],
+    'FIXED': [],
+    'CONDITIONAL': [],
+}
+
+def material_dependencies(material):
+    """
+    Cost-driving fields that can change the budget line of a material, across
+    every item group that can produce it.
+    """
+    dependencies = set(ITEM_DEPENDENCIES.get(material.name, []))
+    if is_internet_service(material.name):
+        dependencies.update(INTERNET_FIELDS)
+    
+    if material.calculation_type in SMART_CALCULATION_TYPES:
+        dependencies.update(CALCULATION_TYPE_DEPENDENCIES.get(material.calculation_type, []))
+        if material.calculation_type == 'CONDITIONAL':
+            dependencies.update(compile_conditions(material.conditions).fields)
+    return dependencies
+
+
+def project_state_key(project):
+    """Hashable snapshot of the cost-driving fields of a project"""
+    return tuple(getattr(project, field) for field in COST_DRIVING_FIELDS)
+
+
+def project_fingerprint(project, state_key=None):
+    """Stable hash of the cost-driving fields of a project (or of a project_state_key())"""
+    if state_key is None:
+        state_key = project_state_key(project)
+    payload = json.dumps(dict(zip(COST_DRIVING_FIELDS, state_key)), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def budget_breakdown_line(line):
+    """(category name, JSON-ready item) of a calculated budget line or a ProjectItem row"""
+    if isinstance(line, dict):
+        material = line['material']
+        values = line
+    else:
+        material = line.material
+        values = {field: getattr(line, field) for field in PROJECT_ITEM_COST_FIELDS}
+    return material.category.name, {
+        'material_id': material.pk,
+        'material_name': material.name,
+        'quantity': values['quantity'],
+        'unit_cost_france': float(values['unit_cost_france']),
+        'unit_cost_morocco': float(values['unit_cost_morocco']),
+        'total_cost_france': float(values['total_cost_france']),
+        'total_cost_morocco': float(values['total_cost_morocco']),
+        'is_auto_calculated': values['is_auto_calculated'],
+    }
+
+
+def group_budget_breakdown(lines):
+    """
+    Per-category breakdown of (category name, item) pairs, as stored in
+    Project.budget_breakdown: items sorted by category then material name,
+    category totals summed exactly and an item count per category.
+    """
+    breakdown = {}
+    for category_name, item in sorted(lines, key=lambda line: (line[0], line[1]['material_name'])):
+        category = breakdown.setdefault(category_name, {'items': [], 'total_france': 0, 'total_morocco': 0})
+        category['items'].append(item)
+    
+    for category in breakdown.values():
+        category['total_france'] = float(sum(
+            (Decimal(str(item['total_cost_france'])) for item in category['items']), Decimal('0')
+        ))
+        category['total_morocco'] = float(sum(
+            (Decimal(str(item['total_cost_morocco'])) for item in category['items']), Decimal('0')
+        ))
+        category['items_count'] = len(category['items'])
+    return breakdown
+
+
+def build_budget_breakdown(lines):
+    """Per-category breakdown of calculated budget lines or ProjectItem rows"""
+    return group_budget_breakdown(budget_breakdown_line(line) for line in lines)
+
+
+class BudgetPlan:
+    """
+    Budget of one project state against one catalog snapshot.
+    
+    Each item group (user, automatic, service, custom) is computed at most once
+    and the merged, priced lines are derived from them lazily. The calculator,
+    the Excel exporter and the breakdown endpoints all read from the same plan.
+    """
+    
+    def __init__(self, calculator, project, catalog, catalog_version=None, custom_items=None, material_names=None,
+                 rule_items=None):
+        self.calculator = calculator
+        self.project = project
+        self.catalog = catalog
+        self.catalog_version = catalog_version
+        # Restrict the plan to these material names (partial recalculation); None for the full budget
+        self.material_names = material_names
+        # Custom and rule items may be precomputed by the vectorized engine, see ProjectCalculator.get_plans()
+        self._custom_items = custom_items
+        self._rule_items = rule_items
+    
+    @cached_property
+    def user_items(self):
+        with self.calculator.trace('user_items'):
+            return self.calculator.get_user_specified_items(self.project)
+    
+    @cached_property
+    def auto_items(self):
+        with self.calculator.trace('auto_items'):
+            auto_items = self.calculator.calculate_automatic_items(self.project)
+            # Active CalculationRules override the built-in quantity of their target material
+            if self._rule_items is None:
+                self._rule_items = self.calculator.calculate_rule_items(self.project)
+            auto_items.update(self._rule_items)
+            return auto_items
+    
+    @cached_property
+    def service_items(self):
+        with self.calculator.trace('service_items'):
+            return self.calculator.get_service_items(self.project)
+    
+    @property
+    def previous_items(self):
+        """Names produced by the user, automatic and service groups"""
+        return set(self.user_items) | set(self.auto_items) | set(self.service_items)
+    
+    @property
+    def custom_items(self):
+        if self._custom_items is None:
+            previous_items = self.previous_items
+            with self.calculator.trace('custom_materials'):
+                self._custom_items = self.calculator.calculate_custom_materials(
+                    self.project, catalog=self.catalog, previous_items=previous_items,
+                    material_names=self.material_names
+                )
+        return self._custom_items
+    
+    @cached_property
+    def all_items(self):
+        """Combine all item groups, avoiding duplicates"""
+        all_items = {}
+        
+        # Add user-specified items first (highest priority)
+        all_items.update(self.user_items)
+        
+        # Then auto-calculated, service and custom items (only if not already calculated)
+        for group in (self.auto_items, self.service_items, self.custom_items):
+            for item_name, quantity in group.items():
+                if item_name not in all_items:
+                    all_items[item_name] = quantity
+        
+        if self.material_names is not None:
+            all_items = {name: quantity for name, quantity in all_items.items() if name in self.material_names}
+        return all_items
+    
+    @cached_property
+    def _priced(self):
+        """Resolve merged items against the catalog and price them"""
+        all_items = self.all_items
+        with self.calculator.trace('resolution'):
+            return self._resolve(all_items)
+    
+    def _resolve(self, all_items):
+        total_france = Decimal('0')
+        total_morocco = Decimal('0')
+        project_items = []
+        unresolved = []
+        
+        for item_name, quantity in all_items.items():
+            if quantity <= 0:
+                continue
+            
+            material = self.catalog.get(item_name)
+            if material is None:
+                # Keep track of missing materials for admin to add
+                unresolved.append({'name': item_name, 'quantity': quantity})
+                continue
+            
+            cost_france = quantity * material.price_france
+            cost_morocco = quantity * material.price_morocco
+            
+            total_france += cost_france
+            total_morocco += cost_morocco
+            
+            project_items.append({
+                'material': material,
+                'quantity': quantity,
+                'unit_cost_france': material.price_france,
+                'unit_cost_morocco': material.price_morocco,
+                'total_cost_france': cost_france,
+                'total_cost_morocco': cost_morocco,
+                # Determine if item is auto-calculated
+                'is_auto_calculated': item_name in self.auto_items
+            })
+        
+        if unresolved:
+            logger.warning(
+                "Materials not found in catalog for project %s: %s",
+                self.project.pk, ', '.join(item['name'] for item in unresolved)
+            )
+        
+        return project_items, total_france, total_morocco, unresolved
+    
+    @property
+    def project_items(self):
+        return self._priced[0]
+    
+    @property
+    def total_france(self):
+        return self._priced[1]
+    
+    @property
+    def total_morocco(self):
+        return self._priced[2]
+    
+    @property
+    def unresolved(self):
+        return self._priced[3]
+    
+    def as_dict(self):
+        """JSON-friendly summary of the plan: totals and priced lines"""
+        return {
+            'total_cost_france': float(self.total_france),
+            'total_cost_morocco': float(self.total_morocco),
+            'items': [
+                {
+                    'material_id': item['material'].pk,
+                    'material_name': item['material'].name,
+                    'category_name': item['material'].category.name,
+                    'quantity': item['quantity'],
+                    'unit_cost_france': float(item['unit_cost_france']),
+                    'unit_cost_morocco': float(item['unit_cost_morocco']),
+                    'total_cost_france': float(item['total_cost_france']),
+                    'total_cost_morocco': float(item['total_cost_morocco']),
+                    'is_auto_calculated': item['is_auto_calculated'],
+                }
+                for item in self.project_items
+            ],
+            'unresolved': self.unresolved,
+        }
 
 
 class ProjectCalculator:
     """Main calculation engine for IT infrastructure projects"""
     
+    MAX_CACHED_PLANS = 128
+    
+    # Process-wide counters of save_project_budget calls skipped (hits) or recalculated (misses),
+    # and of partial recalculations done by update_project_budget
+    cache_stats = {'hits': 0, 'misses': 0, 'partial': 0}
+    
     def __init__(self):
         self.auto_calculated_items = {
             'Rack': 'sites',
@@ -18,6 +342,23 @@ class ProjectCalculator:
             'Network Cables': 'total_devices * 2 * sites',
             'PDU': 'sites * 2',
         }
+        # Material names that could not be matched against the catalog during the last calculation
+        self.unresolved = []
+        # (catalog version, catalog snapshot), memoized plans and quantity engine, see get_plan()
+        self._catalog = None
+        self._plans = {}
+        self._engine = None
+        self._rules = None
+        # Row counts written by the last save_project_budget call, and whether it was skipped
+        self.last_persistence = {}
+        self.last_cache_hit = False
+        # Optional StageTracer recording per-stage timings, see calculations.tracing
+        self.tracer = None
+    
+    def load_catalog(self):
+        """Load all active materials in a single query, keyed by name"""
+        materials = Material.objects.filter(is_active=True).select_related('category')
+        return {material.name: material for material in materials}
     
     def calculate_automatic_items(self, project):
         """Calculate automatically required items based on project specifications"""
@@ -135,145 +476,416 @@ class ProjectCalculator:
             
         return service_items
     
-    def calculate_budget(self, project):
-        """Calculate complete project budget"""
-        # Get all items
-        user_items = self.get_user_specified_items(project)
-        auto_items = self.calculate_automatic_items(project)
-        service_items = self.get_service_items(project)
-        custom_items = self.calculate_custom_materials(project)
+    def get_catalog(self):
+        """
+        Return the active catalog snapshot for the current catalog version.
         
-        # Combine all items, avoiding duplicates
-        all_items = {}
+        The snapshot is kept on the calculator and only reloaded when the
+        catalog version moves, so batch runs load the catalog once.
+        """
+        with self.trace('catalog'):
+            version = CatalogVersion.current()
+            if self._catalog is None or self._catalog[0] != version:
+                self._catalog = (version, self.load_catalog())
+        return self._catalog
+    
+    def trace(self, stage):
+        """Context manager timing a calculation stage when self.tracer is set"""
+        return trace_stage(self.tracer, stage)
+    
+    def get_plan(self, project):
+        """Return the memoized BudgetPlan for this project state and catalog version"""
+        catalog_version, catalog = self.get_catalog()
+        key = (project_state_key(project), catalog_version)
         
-        # Add user-specified items first (highest priority)
-        all_items.update(user_items)
+        plan = self._plans.pop(key, None)
+        if plan is None:
+            plan = BudgetPlan(self, project, catalog, catalog_version)
+        # Re-insert to keep the most recently used plans at the end
+        self._plans[key] = plan
+        while len(self._plans) > self.MAX_CACHED_PLANS:
+            self._plans.pop(next(iter(self._plans)))
+        return plan
+    
+    def get_engine(self):
+        """Return the vectorized QuantityEngine for the current catalog snapshot"""
+        catalog_version, catalog = self.get_catalog()
+        if self._engine is None or self._engine[0] != catalog_version:
+            smart_materials = [
+                material for material in catalog.values()
+                if material.calculation_type in SMART_CALCULATION_TYPES
+            ]
+            self._engine = (catalog_version, QuantityEngine(smart_materials))
+        return self._engine[1]
+    
+    def get_calculation_rules(self):
+        """
+        Return the active CalculationRules as (target material name, compiled formula) pairs.
         
-        # Add auto-calculated items (only if not already in user items)
-        for item_name, quantity in auto_items.items():
-            if item_name not in all_items:
-                all_items[item_name] = quantity
+        Rules are loaded once per catalog version (saving a rule bumps it) and each
+        formula is only parsed again when its rule changed.
+        """
+        catalog_version = self.get_catalog()[0]
+        if self._rules is None or self._rules[0] != catalog_version:
+            rules = []
+            for rule in CalculationRule.objects.filter(is_active=True).select_related('target_material'):
+                try:
+                    rules.append((rule.target_material.name, compile_rule(rule)))
+                except ExpressionError as e:
+                    logger.warning("Calculation rule %s ignored: %s", rule.name, e)
+            self._rules = (catalog_version, rules)
+        return self._rules[1]
+    
+    def calculate_rule_items(self, project):
+        """Quantities of the CalculationRule target materials for one project"""
+        rules = self.get_calculation_rules()
+        if not rules:
+            return {}
         
-        # Add service items (only if not already calculated)
-        for item_name, quantity in service_items.items():
-            if item_name not in all_items:
-                all_items[item_name] = quantity
+        variables = project_variables(project)
+        rule_items = {}
+        for material_name, expression in rules:
+            rule_items.update(self._evaluate_rule(material_name, expression, project, variables))
+        return rule_items
+    
+    def calculate_rule_items_many(self, projects):
+        """Per-project CalculationRule quantities, each formula evaluated once over all projects"""
+        rules = self.get_calculation_rules()
+        if not rules:
+            return [{} for project in projects]
         
-        # Add custom items (only if not already calculated)
-        for item_name, quantity in custom_items.items():
-            if item_name not in all_items:
-                all_items[item_name] = quantity
+        variables = project_variable_arrays(projects)
+        results = [{} for project in projects]
+        for material_name, expression in rules:
+            with np.errstate(all='ignore'):
+                values = np.asarray(expression.evaluate_many(variables), dtype=np.float64)
+            finite = np.isfinite(values)
+            quantities = np.trunc(np.where(finite, values, 0)).astype(np.int64)
+            for row, project in enumerate(projects):
+                if finite[row]:
+                    results[row][material_name] = int(quantities[row])
+                else:
+                    # Division by zero and friends: let the scalar path report it
+                    results[row].update(self._evaluate_rule(material_name, expression, project))
+        return results
+    
+    def _evaluate_rule(self, material_name, expression, project, variables=None):
+        """{material name: quantity} for one rule and project, empty if the formula fails"""
+        if variables is None:
+            variables = project_variables(project)
+        try:
+            return {material_name: int(expression.evaluate(variables))}
+        except (ArithmeticError, ValueError) as e:
+            logger.warning("Calculation rule for %s failed on project %s: %s", material_name, project.pk, e)
+            return {}
+    
+    def get_plans(self, projects):
+        """
+        Build BudgetPlans for many projects at once.
         
-        # Calculate costs
-        total_france = Decimal('0')
-        total_morocco = Decimal('0')
-        project_items = []
+        The smart calculation rules are evaluated for all projects in a single
+        vectorized pass instead of one material and one project at a time.
+        """
+        projects = list(projects)
+        catalog_version, catalog = self.get_catalog()
+        plans = [
+            BudgetPlan(self, project, catalog, catalog_version, rule_items=rule_items)
+            for project, rule_items in zip(projects, self.calculate_rule_items_many(projects))
+        ]
+        if not plans:
+            return plans
         
-        for item_name, quantity in all_items.items():
-            if quantity > 0:
-                try:
-                    material = Material.objects.get(name=item_name, is_active=True)
-                    cost_france = quantity * material.price_france
-                    cost_morocco = quantity * material.price_morocco
-                    
-                    total_france += cost_france
-                    total_morocco += cost_morocco
-                    
-                    # Determine if item is auto-calculated
-                    is_auto = item_name in auto_items
-                    
-                    project_items.append({
-                        'material': material,
-                        'quantity': quantity,
-                        'unit_cost_france': material.price_france,
-                        'unit_cost_morocco': material.price_morocco,
-                        'total_cost_france': cost_france,
-                        'total_cost_morocco': cost_morocco,
-                        'is_auto_calculated': is_auto
-                    })
-                    
-                except Material.DoesNotExist:
-                    # Log missing material for admin to add
-                    print(f"Warning: Material '{item_name}' not found in database")
-                    continue
+        custom_items = self.get_engine().custom_items(projects, [plan.previous_items for plan in plans])
+        for plan, items in zip(plans, custom_items):
+            plan._custom_items = items
+        return plans
+    
+    def get_totals(self, plans, by_category=False):
+        """
+        EUR/MAD totals of many plans, priced in one matrix product.
         
-        return project_items, total_france, total_morocco
+        Returns (total_france, total_morocco) arrays in integer cents and, with
+        by_category, {category name: (france, morocco)} arrays as well. Totals are
+        identical to the per-plan Decimal pricing.
+        """
+        catalog = plans[0].catalog if plans else self.get_catalog()[1]
+        materials = list(catalog.values())
+        columns = {material.name: index for index, material in enumerate(materials)}
+        
+        quantity = np.zeros((len(plans), len(materials)), dtype=np.int64)
+        for row, plan in enumerate(plans):
+            for item_name, item_quantity in plan.all_items.items():
+                column = columns.get(item_name)
+                if column is not None and item_quantity > 0:
+                    quantity[row, column] = item_quantity
+        
+        price_france = np.array([_to_cents(material.price_france) for material in materials], dtype=np.int64)
+        price_morocco = np.array([_to_cents(material.price_morocco) for material in materials], dtype=np.int64)
+        totals = (quantity @ price_france, quantity @ price_morocco)
+        if not by_category:
+            return totals, None
+        
+        categories = {}
+        for index, material in enumerate(materials):
+            categories.setdefault(material.category.name, []).append(index)
+        by_category = {
+            name: (quantity[:, indexes] @ price_france[indexes], quantity[:, indexes] @ price_morocco[indexes])
+            for name, indexes in sorted(categories.items())
+        }
+        return totals, by_category
+    
+    def calculate_budget(self, project, catalog=None):
+        """Calculate complete project budget"""
+        if catalog is None:
+            plan = self.get_plan(project)
+        else:
+            plan = BudgetPlan(self, project, catalog)
+        
+        self.unresolved = plan.unresolved
+        return plan.project_items, plan.total_france, plan.total_morocco
     
     @transaction.atomic
-    def save_project_budget(self, project):
-        """Save calculated budget to database"""
-        # Clear existing items
-        ProjectItem.objects.filter(project=project).delete()
+    def save_project_budget(self, project, reconcile=True, plan=None, force=False):
+        """
+        Save calculated budget to database.
+        
+        The stored budget is skipped entirely (a cache hit) when the project's
+        cost-driving fields and the catalog version are unchanged since it was
+        last saved; force=True recalculates anyway.
+        
+        With reconcile=True (default) the new budget is diffed against the stored
+        ProjectItem rows: only new, changed and obsolete rows are written, using one
+        bulk insert, one bulk update and one delete. With reconcile=False every row
+        is deleted and re-inserted. A plan precomputed by get_plans() can be passed
+        to skip the calculation.
+        """
+        fingerprint = project_fingerprint(project)
+        catalog_version = plan.catalog_version if plan is not None else CatalogVersion.current()
+        
+        self.last_cache_hit = (
+            not force and project.pk is not None and
+            project.budget_fingerprint == fingerprint and
+            project.budget_catalog_version == catalog_version
+        )
+        if self.last_cache_hit:
+            ProjectCalculator.cache_stats['hits'] += 1
+            self.last_persistence = {}
+            return self._stored_budget_lines(project), project.total_cost_france, project.total_cost_morocco
+        ProjectCalculator.cache_stats['misses'] += 1
         
         # Calculate new budget
-        project_items, total_france, total_morocco = self.calculate_budget(project)
+        if plan is None:
+            plan = self.get_plan(project)
+        self.unresolved = plan.unresolved
+        project_items, total_france, total_morocco = plan.project_items, plan.total_france, plan.total_morocco
+        
+        with self.trace('persistence'):
+            if reconcile:
+                self.last_persistence = self._reconcile_project_items(project, project_items)
+            else:
+                # Clear existing items and re-insert them all
+                deleted, _ = ProjectItem.objects.filter(project=project).delete()
+                ProjectItem.objects.bulk_create(
+                    [self._build_project_item(project, item_data) for item_data in project_items]
+                )
+                self.last_persistence = {
+                    'created': len(project_items), 'updated': 0, 'deleted': deleted, 'unchanged': 0
+                }
+            
+            # Update project totals, breakdown and budget fingerprint only when they actually moved
+            breakdown = build_budget_breakdown(project_items)
+            if (project.total_cost_france != total_france or
+                    project.total_cost_morocco != total_morocco or
+                    project.budget_breakdown != breakdown or
+                    project.budget_fingerprint != fingerprint or
+                    project.budget_catalog_version != plan.catalog_version):
+                project.total_cost_france = total_france
+                project.total_cost_morocco = total_morocco
+                project.budget_breakdown = breakdown
+                project.budget_fingerprint = fingerprint
+                project.budget_catalog_version = plan.catalog_version
+                project.save()
+        
+        return project_items, total_france, total_morocco
+    
+    @transaction.atomic
+    def update_project_budget(self, project, previous_state_key):
+        """
+        Partially recalculate the stored budget after some cost-driving fields changed.
+        
+        previous_state_key is project_state_key() of the project before the change.
+        When the stored budget matches that previous state, only the materials that
+        depend on the changed fields are re-evaluated and only their ProjectItem rows
+        are rewritten; totals are adjusted by the difference. Otherwise this falls
+        back to save_project_budget(). Returned items only cover the affected materials.
+        """
+        changed_fields = {
+            field for field, previous in zip(COST_DRIVING_FIELDS, previous_state_key)
+            if getattr(project, field) != previous
+        }
+        catalog_version, catalog = self.get_catalog()
+        
+        budget_is_current = (
+            project.budget_fingerprint == project_fingerprint(project, previous_state_key) and
+            project.budget_catalog_version == catalog_version
+        )
+        if not changed_fields or not budget_is_current:
+            return self.save_project_budget(project)
+        
+        ProjectCalculator.cache_stats['partial'] += 1
+        affected = {
+            name for name, material in catalog.items()
+            if material_dependencies(material) & changed_fields
+        }
+        affected.update(
+            material_name for material_name, expression in self.get_calculation_rules()
+            if expression.fields & changed_fields
+        )
+        plan = BudgetPlan(self, project, catalog, catalog_version, material_names=affected)
+        self.unresolved = plan.unresolved
+        
+        with self.trace('persistence'):
+            existing = list(ProjectItem.objects.filter(project=project, material__name__in=affected))
+            old_france = sum((item.total_cost_france for item in existing), Decimal('0'))
+            old_morocco = sum((item.total_cost_morocco for item in existing), Decimal('0'))
+            self.last_persistence = self._reconcile_project_items(project, plan.project_items, existing)
+            
+            project.total_cost_france = project.total_cost_france - old_france + plan.total_france
+            project.total_cost_morocco = project.total_cost_morocco - old_morocco + plan.total_morocco
+            project.budget_fingerprint = project_fingerprint(project)
+            if project.budget_breakdown is None:
+                project.budget_breakdown = build_budget_breakdown(
+                    ProjectItem.objects.filter(project=project).select_related('material__category')
+                )
+            else:
+                # Swap the lines of the affected materials in the stored breakdown
+                lines = [
+                    (category_name, item)
+                    for category_name, category in project.budget_breakdown.items()
+                    for item in category['items']
+                    if item['material_name'] not in affected
+                ]
+                lines.extend(budget_breakdown_line(item_data) for item_data in plan.project_items)
+                project.budget_breakdown = group_budget_breakdown(lines)
+            project.save()
+        
+        return plan.project_items, project.total_cost_france, project.total_cost_morocco
+    
+    def _stored_budget_lines(self, project):
+        """Budget lines of the stored ProjectItem rows, in calculate_budget() format"""
+        items = ProjectItem.objects.filter(project=project).select_related('material__category')
+        return [
+            {
+                'material': item.material,
+                **{field: getattr(item, field) for field in PROJECT_ITEM_COST_FIELDS}
+            }
+            for item in items
+        ]
+    
+    def _build_project_item(self, project, item_data):
+        """Build an unsaved ProjectItem from a calculated budget line"""
+        return ProjectItem(
+            project=project,
+            material=item_data['material'],
+            **{field: item_data[field] for field in PROJECT_ITEM_COST_FIELDS}
+        )
+    
+    def _reconcile_project_items(self, project, project_items, existing_items=None):
+        """
+        Diff calculated budget lines against stored rows and write only the differences.
+        existing_items limits the diff to those rows (default: all rows of the project).
+        """
+        if existing_items is None:
+            existing_items = ProjectItem.objects.filter(project=project)
+        existing = {item.material_id: item for item in existing_items}
+        now = timezone.now()
+        
+        to_create = []
+        to_update = []
+        unchanged = 0
         
-        # Save project items
         for item_data in project_items:
-            ProjectItem.objects.create(
-                project=project,
-                material=item_data['material'],
-                quantity=item_data['quantity'],
-                is_auto_calculated=item_data['is_auto_calculated'],
-                unit_cost_france=item_data['unit_cost_france'],
-                unit_cost_morocco=item_data['unit_cost_morocco'],
-                total_cost_france=item_data['total_cost_france'],
-                total_cost_morocco=item_data['total_cost_morocco']
-            )
+            item = existing.pop(item_data['material'].pk, None)
+            if item is None:
+                to_create.append(self._build_project_item(project, item_data))
+                continue
+            
+            changed = False
+            for field in PROJECT_ITEM_COST_FIELDS:
+                if getattr(item, field) != item_data[field]:
+                    setattr(item, field, item_data[field])
+                    changed = True
+            
+            if changed:
+                # bulk_update does not apply auto_now
+                item.updated_at = now
+                to_update.append(item)
+            else:
+                unchanged += 1
         
-        # Update project totals
-        project.total_cost_france = total_france
-        project.total_cost_morocco = total_morocco
-        project.save()
+        # Whatever is left over is no longer part of the budget
+        if existing:
+            ProjectItem.objects.filter(pk__in=[item.pk for item in existing.values()]).delete()
+        if to_create:
+            ProjectItem.objects.bulk_create(to_create)
+        if to_update:
+            ProjectItem.objects.bulk_update(to_update, PROJECT_ITEM_COST_FIELDS + ['updated_at'])
         
-        return project_items, total_france, total_morocco
+        return {
+            'created': len(to_create),
+            'updated': len(to_update),
+            'deleted': len(existing),
+            'unchanged': unchanged,
+        }
     
     def get_budget_breakdown(self, project):
-        """Get budget breakdown by category"""
-        items = ProjectItem.objects.filter(project=project).select_related('material__category')
+        """
+        Get budget breakdown by category, with JSON-ready item lines.
         
-        breakdown = {}
-        for item in items:
-            category_name = item.material.category.name
-            if category_name not in breakdown:
-                breakdown[category_name] = {
-                    'items': [],
-                    'total_france': Decimal('0'),
-                    'total_morocco': Decimal('0')
-                }
+        Returns the breakdown materialized on the project by save_project_budget().
+        Projects without one get it built from their ProjectItem rows and stored.
+        """
+        with self.trace('breakdown'):
+            if project.budget_breakdown is not None:
+                return project.budget_breakdown
             
-            breakdown[category_name]['items'].append(item)
-            breakdown[category_name]['total_france'] += item.total_cost_france
-            breakdown[category_name]['total_morocco'] += item.total_cost_morocco
-        
-        return breakdown
-
-    def calculate_custom_materials(self, project):
-        """Calculate quantities for custom materials based on smart rules"""
-        from materials.models import Material
-        
-        # Get all previously calculated items to avoid duplication
-        user_items = self.get_user_specified_items(project)
-        auto_items = self.calculate_automatic_items(project)
-        service_items = self.get_service_items(project)
-        
-        # Combine all previously calculated items
-        all_previous_items = set()
-        all_previous_items.update(user_items.keys())
-        all_previous_items.update(auto_items.keys())
-        all_previous_items.update(service_items.keys())
-        
-        custom_materials = Material.objects.filter(
-            is_active=True,
-            calculation_type__in=['PER_USER', 'PER_SERVER', 'PER_PC', 'PER_DEVICE', 'PER_SWITCH', 'PER_PROJECT', 'FIXED', 'CONDITIONAL']
-        )
+            items = ProjectItem.objects.filter(project=project).select_related('material__category')
+            project.budget_breakdown = build_budget_breakdown(items)
+            if project.pk is not None:
+                Project.objects.filter(pk=project.pk).update(budget_breakdown=project.budget_breakdown)
+        
+        return project.budget_breakdown
+
+    def calculate_custom_materials(self, project, catalog=None, previous_items=None, material_names=None):
+        """
+        Calculate quantities for custom materials based on smart rules.
+        
+        previous_items is the set of material names already produced by the
+        user, automatic and service groups; it is derived here when not given.
+        material_names optionally restricts the evaluation to those materials.
+        """
+        if catalog is None:
+            catalog = self.load_catalog()
+        
+        if previous_items is None:
+            # Get all previously calculated items to avoid duplication
+            previous_items = set()
+            previous_items.update(self.get_user_specified_items(project).keys())
+            previous_items.update(self.calculate_automatic_items(project).keys())
+            previous_items.update(self.get_service_items(project).keys())
+        
+        custom_materials = [
+            material for material in catalog.values()
+            if material.calculation_type in SMART_CALCULATION_TYPES and
+            (material_names is None or material.name in material_names)
+        ]
         
         calculated_items = {}
         
         for material in custom_materials:
             # Skip materials that are already handled by other calculation methods
             # EXCEPT for materials that should be included in smart calculation
-            if material.name in all_previous_items:
+            if material.name in previous_items:
                 # Only skip if it's a duplicate that shouldn't be recalculated
                 # Allow smart calculation materials to override auto-calculated ones
                 if material.calculation_type in ['PER_USER', 'PER_SERVER', 'PER_PC', 'PER_DEVICE']:
@@ -369,21 +981,7 @@ class ProjectCalculator:
 
     def _check_conditions(self, conditions, project):
         """Check if project meets material conditions"""
-        for condition, value in conditions.items():
-            if condition == 'min_users' and project.number_of_users < value:
-                return False
-            elif condition == 'max_users' and project.number_of_users > value:
-                return False
-            elif condition == 'min_servers' and (project.num_laptop_office + project.num_desktop_office) < value:
-                return False
-            elif condition == 'has_videoconference' and project.num_videoconference == 0:
-                return False
-            elif condition == 'has_file_server' and not project.file_server:
-                return False
-            elif condition == 'has_local_apps' and not project.local_apps:
-                return False
-            # Add more conditions as needed
-        return True
+        return compile_conditions(conditions).evaluate(project_condition_values(project))
     
     def _is_internet_service(self, material_name):
         """Check if a material is an internet service"""
@@ -407,6 +1005,276 @@ class ProjectCalculator:
         return selected_service in material_name
 
 
+class CapacitySweep:
+    """
+    Budget curves of a base project spec over a grid of one or two varying dimensions.
+    
+    Dimensions:
+      - number_of_users: user counts
+      - laptop_share: share (0 to 1) of the office PCs that are laptops; one office PC
+        per user not covered by the base spec's technical laptops/desktops
+      - internet_line: (internet_line_type, internet_line_speed) pairs
+    
+    All grid points are evaluated in one batched pass: the smart rules with the
+    vectorized engine (ProjectCalculator.get_plans) and the pricing as one matrix
+    product (ProjectCalculator.get_totals).
+    """
+    
+    DIMENSIONS = ['number_of_users', 'laptop_share', 'internet_line']
+    MAX_DIMENSIONS = 2
+    MAX_POINTS = 10000
+    
+    def __init__(self, base_project, dimensions):
+        """dimensions is a list of (name, values) pairs; raises ValueError if invalid"""
+        if not dimensions or len(dimensions) > self.MAX_DIMENSIONS:
+            raise ValueError(f'Expected 1 to {self.MAX_DIMENSIONS} dimensions')
+        
+        names = [name for name, values in dimensions]
+        unknown = [name for name in names if name not in self.DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown dimension(s): {', '.join(unknown)}")
+        if len(set(names)) != len(names):
+            raise ValueError('Each dimension can only be given once')
+        
+        self.base_project = base_project
+        self.dimensions = [(name, self._clean_values(name, values)) for name, values in dimensions]
+        
+        size = math.prod(len(values) for name, values in self.dimensions)
+        if size > self.MAX_POINTS:
+            raise ValueError(f'Grid too large: {size} points (maximum {self.MAX_POINTS})')
+    
+    def _clean_values(self, name, values):
+        if not values:
+            raise ValueError(f'No values given for {name}')
+        
+        if name == 'number_of_users':
+            if any(not isinstance(value, int) or value < 0 for value in values):
+                raise ValueError('number_of_users values must be non-negative integers')
+            return list(values)
+        
+        if name == 'laptop_share':
+            if any(not isinstance(value, (int, float)) or not 0 <= value <= 1 for value in values):
+                raise ValueError('laptop_share values must be between 0 and 1')
+            return [float(value) for value in values]
+        
+        lines = []
+        for value in values:
+            if isinstance(value, dict):
+                value = (value.get('internet_line_type'), value.get('internet_line_speed'))
+            elif isinstance(value, str):
+                value = tuple(value.split(':', 1)) if ':' in value else (None, None)
+            if not isinstance(value, (tuple, list)) or len(value) != 2 or not all(value):
+                raise ValueError('internet_line values must be "TYPE:SPEED" strings')
+            if value[0] not in Project.InternetLineType.values:
+                raise ValueError(f'Unknown internet line type: {value[0]}')
+            lines.append((value[0], value[1]))
+        return lines
+    
+    @staticmethod
+    def expand_range(start, stop, step):
+        """Values from start to stop inclusive; integers stay integers"""
+        if not step or step <= 0:
+            raise ValueError('Range step must be positive')
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        if count > CapacitySweep.MAX_POINTS:
+            raise ValueError(f'Range too large: {count} values (maximum {CapacitySweep.MAX_POINTS})')
+        return [start + index * step for index in range(max(0, count))]
+    
+    @staticmethod
+    def _label(name, value):
+        return ':'.join(value) if name == 'internet_line' else value
+    
+    def grid(self):
+        """Grid points as {dimension: value} dicts, the first dimension varying slowest"""
+        names = [name for name, values in self.dimensions]
+        return [
+            dict(zip(names, point))
+            for point in itertools.product(*[values for name, values in self.dimensions])
+        ]
+    
+    def build_project(self, point):
+        """Unsaved copy of the base project with one grid point applied"""
+        project = copy.copy(self.base_project)
+        if 'number_of_users' in point:
+            project.number_of_users = point['number_of_users']
+        if 'internet_line' in point:
+            project.internet_line_type, project.internet_line_speed = point['internet_line']
+        if 'laptop_share' in point:
+            office_pcs = max(0, project.number_of_users - project.num_laptop_tech - project.num_desktop_tech)
+            project.num_laptop_office = int(round(office_pcs * point['laptop_share']))
+            project.num_desktop_office = office_pcs - project.num_laptop_office
+        return project
+    
+    def run(self, calculator=None, by_category=False):
+        """Evaluate the whole grid; returns one result dict per point"""
+        calculator = calculator or ProjectCalculator()
+        points = self.grid()
+        projects = [self.build_project(point) for point in points]
+        plans = calculator.get_plans(projects)
+        (total_france, total_morocco), categories = calculator.get_totals(plans, by_category=by_category)
+        
+        results = []
+        for row, (point, project) in enumerate(zip(points, projects)):
+            france = int(total_france[row]) / 100
+            morocco = int(total_morocco[row]) / 100
+            users = project.number_of_users
+            result = {name: self._label(name, value) for name, value in point.items()}
+            result.update({
+                'total_cost_france': france,
+                'total_cost_morocco': morocco,
+                'cost_per_user_france': round(france / users, 2) if users > 0 else 0,
+                'cost_per_user_morocco': round(morocco / users, 2) if users > 0 else 0,
+            })
+            if categories is not None:
+                result['categories'] = {
+                    name: {'total_france': int(france_cents[row]) / 100, 'total_morocco': int(morocco_cents[row]) / 100}
+                    for name, (france_cents, morocco_cents) in categories.items()
+                }
+            results.append(result)
+        return results
+
+
+class PriceChangePropagator:
+    """
+    Re-costs stored budgets after material price changes.
+    
+    ProjectItem's material foreign key acts as the material -> projects reverse
+    index: only the rows of the changed materials and the projects containing
+    them are touched, with set-based updates and no per-project calculation.
+    """
+    
+    @staticmethod
+    @transaction.atomic
+    def propagate(material_ids):
+        """
+        Apply current material prices to stored ProjectItem rows and re-aggregate
+        the totals of the affected projects.
+        
+        Returns the number of updated items and the ids of the affected projects.
+        """
+        material_ids = list(material_ids)
+        if not material_ids:
+            return {'items_updated': 0, 'project_ids': []}
+        
+        now = timezone.now()
+        items = ProjectItem.objects.filter(material_id__in=material_ids)
+        project_ids = list(items.order_by().values_list('project_id', flat=True).distinct())
+        
+        # One UPDATE for all items of the changed materials
+        material = Material.objects.filter(pk=OuterRef('material_id'))
+        price_france = Subquery(material.values('price_france')[:1])
+        price_morocco = Subquery(material.values('price_morocco')[:1])
+        items_updated = items.update(
+            unit_cost_france=price_france,
+            unit_cost_morocco=price_morocco,
+            total_cost_france=F('quantity') * price_france,
+            total_cost_morocco=F('quantity') * price_morocco,
+            updated_at=now,
+        )
+        
+        # One UPDATE re-aggregating the totals of the affected projects; their
+        # materialized breakdowns are dropped and rebuilt on the next read
+        project_items = ProjectItem.objects.filter(project=OuterRef('pk')).values('project')
+        zero = Value(Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        Project.objects.filter(pk__in=project_ids).update(
+            total_cost_france=Coalesce(
+                Subquery(project_items.annotate(total=Sum('total_cost_france')).values('total')[:1]), zero
+            ),
+            total_cost_morocco=Coalesce(
+                Subquery(project_items.annotate(total=Sum('total_cost_morocco')).values('total')[:1]), zero
+            ),
+            budget_breakdown=None,
+            updated_at=now,
+        )
+        
+        return {'items_updated': items_updated, 'project_ids': project_ids}
+
+
+# Materials written per UPDATE statement by MoroccoRepricer
+REPRICE_BATCH_SIZE = 500
+
+
+class MoroccoRepricer:
+    """
+    Recomputes price_morocco from price_france at a stored EUR/MAD ExchangeRate.
+    
+    All eligible materials (active, with a EUR price) are locked, repriced with
+    batched UPDATEs, their PriceHistory rows are written with one bulk insert and, unless
+    disabled, stored budgets are re-costed by PriceChangePropagator.
+    """
+    
+    @staticmethod
+    @transaction.atomic
+    def reprice(exchange_rate, materials=None, user=None, reason='', propagate=True, dry_run=False):
+        """
+        Reprice materials (a Material queryset, default: the whole catalog) at exchange_rate.
+        
+        Returns the repriced materials (id, name, old and new MAD price) and the
+        projects whose budgets contain them. With dry_run nothing is written.
+        """
+        if materials is None:
+            materials = Material.objects.all()
+        eligible = materials.filter(is_active=True, price_france__gt=0).order_by('pk')
+        if not dry_run:
+            # Lock the rows until the transaction ends, so the prices read here are the ones replaced
+            eligible = eligible.select_for_update()
+        
+        changes = []
+        repriced = []
+        now = timezone.now()
+        for material in eligible.only('pk', 'name', 'price_france', 'price_morocco'):
+            new_price_morocco = _quant2(material.price_france * exchange_rate.rate)
+            if new_price_morocco != material.price_morocco:
+                changes.append({
+                    'material_id': material.pk,
+                    'material_name': material.name,
+                    'price_france': material.price_france,
+                    'old_price_morocco': material.price_morocco,
+                    'new_price_morocco': new_price_morocco,
+                })
+                material.price_morocco = new_price_morocco
+                material.updated_at = now
+                repriced.append(material)
+        
+        material_ids = [change['material_id'] for change in changes]
+        affected_projects = list(
+            Project.objects.filter(items__material_id__in=material_ids).distinct()
+            .order_by('pk').values('id', 'name')
+        ) if material_ids else []
+        result = {
+            'rate': exchange_rate.rate,
+            'rate_fetched_at': exchange_rate.fetched_at,
+            'materials_updated': len(changes),
+            'materials': changes,
+            'affected_projects': affected_projects,
+            'items_updated': 0,
+            'dry_run': dry_run,
+        }
+        if dry_run or not changes:
+            return result
+        
+        # Batched UPDATEs, so the statement size stays bounded for any catalog size
+        Material.objects.bulk_update(repriced, ['price_morocco', 'updated_at'], batch_size=REPRICE_BATCH_SIZE)
+        PriceHistory.objects.bulk_create([
+            PriceHistory(
+                material_id=change['material_id'],
+                old_price_france=change['price_france'],
+                new_price_france=change['price_france'],
+                old_price_morocco=change['old_price_morocco'],
+                new_price_morocco=change['new_price_morocco'],
+                changed_by=user,
+                reason=reason or f"EUR/MAD repricing at {exchange_rate.rate}",
+            )
+            for change in changes
+        ])
+        # update() bypasses Material.save, so invalidate cached catalogs explicitly
+        CatalogVersion.bump()
+        
+        if propagate:
+            result['items_updated'] = PriceChangePropagator.propagate(material_ids)['items_updated']
+        return result
+
+
 class MaterialManager:
     """Helper class for managing materials and categories"""
     
@@ -0,0 +1,109 @@
+import numpy as np
+
+from materials.models import PriceHistory
+from calculations.models import ProjectItem
+
+
+PERCENTILES = [50, 90, 95]
+
+
+class BudgetRiskSimulation:
+    """
+    Monte Carlo simulation of a stored project budget under price uncertainty.
+
+    For every material of the project, relative price changes are bootstrapped
+    from its PriceHistory (new / old - 1, per currency). Materials without any
+    recorded change draw from the pooled changes of the whole catalog. Each trial
+    compounds `horizon` draws per material and re-prices the project's ProjectItem
+    quantities; all trials are evaluated at once with NumPy.
+    """
+
+    MAX_TRIALS = 100000
+    MAX_HORIZON = 24
+
+    def __init__(self, project, trials=10000, horizon=1, seed=None):
+        if not 1 <= trials <= self.MAX_TRIALS:
+            raise ValueError(f'trials must be between 1 and {self.MAX_TRIALS}')
+        if not 1 <= horizon <= self.MAX_HORIZON:
+            raise ValueError(f'horizon must be between 1 and {self.MAX_HORIZON}')
+        self.project = project
+        self.trials = trials
+        self.horizon = horizon
+        self.rng = np.random.default_rng(seed)
+
+    def load_changes(self):
+        """Relative price changes per material id, and pooled, for each currency"""
+        changes = {'france': {}, 'morocco': {}}
+        history = PriceHistory.objects.values_list(
+            'material_id', 'old_price_france', 'new_price_france', 'old_price_morocco', 'new_price_morocco'
+        )
+        for material_id, old_france, new_france, old_morocco, new_morocco in history:
+            if old_france:
+                changes['france'].setdefault(material_id, []).append(float(new_france / old_france) - 1)
+            if old_morocco:
+                changes['morocco'].setdefault(material_id, []).append(float(new_morocco / old_morocco) - 1)
+
+        pooled = {
+            currency: np.array([change for values in by_material.values() for change in values])
+            for currency, by_material in changes.items()
+        }
+        return changes, pooled
+
+    def price_factors(self, material_ids, changes, pooled):
+        """trials x materials matrix of compounded price factors"""
+        factors = np.ones((self.trials, len(material_ids)))
+        for column, material_id in enumerate(material_ids):
+            pool = changes.get(material_id)
+            pool = np.array(pool) if pool else pooled
+            if not len(pool):
+                continue
+            draws = self.rng.choice(pool, size=(self.trials, self.horizon))
+            factors[:, column] = np.prod(1 + draws, axis=1)
+        return factors
+
+    def run(self):
+        items = list(
+            ProjectItem.objects.filter(project=self.project)
+            .select_related('material__category')
+            .order_by('material_id')
+        )
+        material_ids = [item.material_id for item in items]
+        categories = {}
+        for column, item in enumerate(items):
+            categories.setdefault(item.material.category.name, []).append(column)
+
+        changes, pooled = self.load_changes()
+        result = {
+            'project_id': self.project.id,
+            'project_name': self.project.name,
+            'trials': self.trials,
+            'horizon': self.horizon,
+            'materials_count': len(items),
+            'materials_with_history': len([
+                material_id for material_id in material_ids
+                if material_id in changes['france'] or material_id in changes['morocco']
+            ]),
+        }
+
+        for currency in ('france', 'morocco'):
+            base = np.array([float(getattr(item, f'total_cost_{currency}')) for item in items])
+            factors = self.price_factors(material_ids, changes[currency], pooled[currency])
+            costs = factors * base
+
+            result[currency] = self.summarize(costs.sum(axis=1), base.sum())
+            result[currency]['categories'] = {
+                name: self.summarize(costs[:, columns].sum(axis=1), base[columns].sum())
+                for name, columns in sorted(categories.items())
+            }
+        return result
+
+    def summarize(self, totals, base_total):
+        """Base total, mean and percentiles of simulated totals"""
+        summary = {
+            'base': round(float(base_total), 2),
+            'mean': round(float(totals.mean()), 2),
+        }
+        for percent, value in zip(PERCENTILES, np.percentile(totals, PERCENTILES)):
+            summary[f'p{percent}'] = round(float(value), 2)
+        summary['contingency_p90'] = round(summary['p90'] - summary['base'], 2)
+        return summary
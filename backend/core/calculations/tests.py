@@ -0,0 +1,202 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from accounts.models import User
+from calculations.engine import QuantityEngine
+from calculations.expressions import (
+    ExpressionError, compile_expression, project_variable_arrays, project_variables,
+)
+from calculations.models import ProjectItem
+from calculations.services import MaterialManager, ProjectCalculator, project_state_key
+from materials.models import Category, Material
+from projects.models import Project
+
+
+# (name, calculation type, multiplier, min quantity, max quantity, conditions)
+SMART_MATERIALS = [
+    ('Antivirus', 'PER_USER', '1.00', 5, 999999, {}),
+    ('Headset', 'PER_USER', '0.35', 0, 40, {}),
+    ('Backup licence', 'PER_SERVER', '2', 0, 999999, {}),
+    ('Mouse', 'PER_PC', '0.29', 3, 100, {}),
+    ('Docking Station', 'PER_DEVICE', '1', 0, 999999, {}),
+    ('Cable kit', 'PER_DEVICE', '1.5', 0, 999999, {}),
+    ('Patch panel', 'PER_SWITCH', '1.5', 0, 999999, {}),
+    ('Project support', 'PER_PROJECT', '3', 0, 999999, {}),
+    ('Support', 'FIXED', '1', 0, 999999, {}),
+    ('Fiber Optic 100MBps', 'FIXED', '1', 0, 999999, {}),
+    ('STARLINK 200MBps', 'FIXED', '1', 0, 999999, {}),
+    ('Traceur A0', 'FIXED', '1', 0, 999999, {}),
+    ('Application server', 'FIXED', '1', 0, 999999, {}),
+    ('Big firewall', 'CONDITIONAL', '1', 0, 999999, {'min_users': 100, 'has_file_server': True}),
+    ('Small site kit', 'CONDITIONAL', '2', 0, 999999, {'max_users': 30}),
+    ('Visio licence', 'CONDITIONAL', '2', 0, 999999, {'has_videoconference': True}),
+    ('Local apps gateway', 'CONDITIONAL', '1', 0, 999999, {'has_local_apps': False, 'min_servers': 5}),
+]
+
+# Project specs covering the branches of every calculation type
+PROJECT_SPECS = [
+    {},
+    {'number_of_users': 5, 'num_laptop_office': 1},
+    {'number_of_users': 150, 'num_laptop_office': 60, 'num_laptop_tech': 20, 'num_desktop_office': 10,
+     'num_desktop_tech': 5, 'file_server': True, 'local_apps': True, 'num_traceau': 2,
+     'num_videoconference': 3, 'internet_line_type': 'FO', 'internet_line_speed': '100MBps'},
+    {'number_of_users': 120, 'num_laptop_office': 30, 'file_server': True,
+     'internet_line_type': 'STARLINK', 'internet_line_speed': '200MBps'},
+    {'number_of_users': 30, 'num_desktop_office': 12, 'internet_line_type': 'VSAT', 'internet_line_speed': '1GBps'},
+    {'number_of_users': 1000, 'num_laptop_tech': 400, 'local_apps': True, 'num_traceau': 1},
+]
+
+
+def create_smart_materials():
+    """The SMART_MATERIALS not in the catalog yet"""
+    category = Category.objects.create(name='Smart rules')
+    existing = set(Material.objects.values_list('name', flat=True))
+    return [
+        Material.objects.create(
+            name=name, category=category, price_france=Decimal('12.34'), price_morocco=Decimal('133.27'),
+            calculation_type=calculation_type, multiplier=Decimal(multiplier),
+            min_quantity=min_quantity, max_quantity=max_quantity, conditions=conditions,
+        )
+        for name, calculation_type, multiplier, min_quantity, max_quantity, conditions in SMART_MATERIALS
+        if name not in existing
+    ]
+
+
+def build_project(user=None, **spec):
+    fields = {
+        'name': 'Project', 'number_of_users': 10, 'num_laptop_office': 0, 'num_laptop_tech': 0,
+        'num_desktop_office': 0, 'num_desktop_tech': 0, 'created_by': user,
+    }
+    fields.update(spec)
+    return Project(**fields)
+
+
+class QuantityEngineTests(TestCase):
+    """The vectorized engine gives the same quantities as the scalar rules"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.materials = create_smart_materials()
+        cls.projects = [build_project(**spec) for spec in PROJECT_SPECS]
+
+    def test_quantities_match_scalar_rules(self):
+        calculator = ProjectCalculator()
+        quantities = QuantityEngine(self.materials).quantities(self.projects)
+        for row, project in enumerate(self.projects):
+            for column, material in enumerate(self.materials):
+                with self.subTest(project=row, material=material.name):
+                    self.assertEqual(
+                        int(quantities[row, column]),
+                        calculator._calculate_material_quantity(material, project),
+                    )
+
+    def test_custom_items_match_calculate_custom_materials(self):
+        calculator = ProjectCalculator()
+        catalog = {material.name: material for material in self.materials}
+        previous_items = [set(), {'Antivirus', 'Support', 'Patch panel'}]
+        for names in previous_items:
+            engine_items = QuantityEngine(self.materials).custom_items(self.projects, [names] * len(self.projects))
+            for row, project in enumerate(self.projects):
+                with self.subTest(project=row, previous_items=sorted(names)):
+                    self.assertEqual(
+                        engine_items[row],
+                        calculator.calculate_custom_materials(project, catalog, previous_items=set(names)),
+                    )
+
+
+class PartialRecalculationTests(TestCase):
+    """Recalculating only the affected lines on update gives the full recalculation"""
+
+    @classmethod
+    def setUpTestData(cls):
+        MaterialManager.create_default_categories()
+        MaterialManager.create_default_materials()
+        create_smart_materials()
+        cls.user = User.objects.create_user(username='owner', password='secret')
+
+    def stored_budget(self, project):
+        project.refresh_from_db()
+        items = {
+            item.material.name: (
+                item.quantity, item.total_cost_france, item.total_cost_morocco,
+            )
+            for item in ProjectItem.objects.filter(project=project).select_related('material')
+        }
+        return items, project.total_cost_france, project.total_cost_morocco, project.budget_breakdown
+
+    def test_partial_update_matches_full_recalculation(self):
+        changes = [
+            {'number_of_users': 150},
+            {'file_server': True},
+            {'local_apps': True, 'num_traceau': 2},
+            {'num_laptop_office': 3, 'num_desktop_tech': 7},
+            {'internet_line_type': 'STARLINK', 'internet_line_speed': '200MBps'},
+            {'num_videoconference': 2, 'number_of_users': 25},
+        ]
+        for change in changes:
+            with self.subTest(change=change):
+                project = build_project(
+                    self.user, number_of_users=60, num_laptop_office=20, num_desktop_office=5,
+                    internet_line_type='FO', internet_line_speed='100MBps',
+                )
+                project.save()
+                calculator = ProjectCalculator()
+                calculator.save_project_budget(project)
+
+                previous_state_key = project_state_key(project)
+                for field, value in change.items():
+                    setattr(project, field, value)
+                project.save()
+                partial_before = ProjectCalculator.cache_stats['partial']
+                ProjectCalculator().update_project_budget(project, previous_state_key)
+                self.assertEqual(ProjectCalculator.cache_stats['partial'], partial_before + 1)
+                partial = self.stored_budget(project)
+
+                ProjectCalculator().save_project_budget(project, force=True)
+                self.assertEqual(partial, self.stored_budget(project))
+
+
+class ExpressionSandboxTests(TestCase):
+    """Formulas only allow arithmetic over the project variables and a few functions"""
+
+    def test_rejects_unsafe_expressions(self):
+        formulas = [
+            'users.__class__',
+            '(1).real',
+            '__import__("os")',
+            '__builtins__',
+            'open("/etc/passwd")',
+            'getattr(users, "__class__")',
+            'math.sqrt(users)',
+            'os.system("ls")',
+            'users.bit_length()',
+            '(lambda: 1)()',
+            '[users for users in range(10)]',
+            'users[0]',
+            '"text"',
+            'ceil(x=users)',
+            'users ** 100000',
+            'users if users else __name__',
+        ]
+        for formula in formulas:
+            with self.subTest(formula=formula):
+                with self.assertRaises(ExpressionError):
+                    compile_expression(formula)
+
+    def test_scalar_and_vectorized_results_match(self):
+        projects = [build_project(**spec) for spec in PROJECT_SPECS]
+        arrays = project_variable_arrays(projects)
+        formulas = [
+            'ceil(users / 48) + 2',
+            'math.floor(pcs * 1.5)',
+            'max(laptops, 3, desktops)',
+            'users // 10 if file_server and not local_apps else servers',
+            '10 < users <= 150',
+        ]
+        for formula in formulas:
+            expression = compile_expression(formula)
+            many = expression.evaluate_many(arrays)
+            for row, project in enumerate(projects):
+                with self.subTest(formula=formula, project=row):
+                    self.assertEqual(float(many[row]), float(expression.evaluate(project_variables(project))))
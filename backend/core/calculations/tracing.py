@@ -0,0 +1,82 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.db import connection
+
+
+class StageTracer:
+    """
+    Wall time and database query count/time per calculation stage.
+
+    Queries are counted with a connection execute wrapper, so tracing works
+    without DEBUG. Stages may repeat (e.g. several plans in one request); their
+    figures are accumulated. Nested stages are charged to the innermost one.
+
+    Used as a context manager, the tracer also counts the queries run outside
+    any stage (loading the project, serialization...) in its totals.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._current = []
+        self._started = time.perf_counter()
+        self._queries = 0
+        self._query_time = 0.0
+        self._span = None
+
+    def __enter__(self):
+        self._span = connection.execute_wrapper(self._record)
+        self._span.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        span, self._span = self._span, None
+        return span.__exit__(*exc_info)
+
+    def _record(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._queries += 1
+            self._query_time += elapsed
+            if self._current:
+                stage = self.stages[self._current[-1]]
+                stage['queries'] += 1
+                stage['query_ms'] += elapsed * 1000
+
+    @contextmanager
+    def stage(self, name):
+        stage = self.stages.setdefault(name, {'calls': 0, 'wall_ms': 0.0, 'queries': 0, 'query_ms': 0.0})
+        stage['calls'] += 1
+        # Only the outermost stage of an unwrapped tracer installs the wrapper, so each query is counted once
+        wrapper = connection.execute_wrapper(self._record) if not self._current and self._span is None else nullcontext()
+        self._current.append(name)
+        started = time.perf_counter()
+        try:
+            with wrapper:
+                yield
+        finally:
+            self._current.pop()
+            elapsed = (time.perf_counter() - started) * 1000
+            stage['wall_ms'] += elapsed
+            # Time spent in nested stages belongs to them only
+            if self._current:
+                self.stages[self._current[-1]]['wall_ms'] -= elapsed
+
+    def as_dict(self):
+        return {
+            'total_ms': round((time.perf_counter() - self._started) * 1000, 3),
+            'queries': self._queries,
+            'query_ms': round(self._query_time * 1000, 3),
+            'stages': {
+                name: {key: round(value, 3) if isinstance(value, float) else value for key, value in stage.items()}
+                for name, stage in self.stages.items()
+            },
+        }
+
+
+def trace_stage(tracer, name):
+    """tracer.stage(name), or a no-op context when tracing is off"""
+    return tracer.stage(name) if tracer is not None else nullcontext()
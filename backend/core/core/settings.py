@@ -51,6 +51,7 @@ INSTALLED_APPS = [
     'materials',
     'calculations',
     'dashboard',
+    'benchmarks',
 ]
 
 MIDDLEWARE = [
@@ -5,7 +5,7 @@ from django.utils.safestring import mark_safe
 from django.core.exceptions import ValidationError
 from django.shortcuts import redirect
 from django import forms
-from .models import Material, Category, PriceHistory
+from .models import Material, Category, PriceHistory, ExchangeRate
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -142,3 +142,9 @@ class PriceHistoryAdmin(admin.ModelAdmin):
             'fields': ('changed_by', 'changed_at', 'reason')
         })
     )
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('base_currency', 'quote_currency', 'rate', 'provider', 'fetched_at')
+    list_filter = ('base_currency', 'quote_currency', 'provider')
+    readonly_fields = ('fetched_at',)
@@ -0,0 +1,205 @@
+"""
+Conditions of CONDITIONAL materials.
+
+Material.conditions is a JSON dict such as {"min_users": 100, "has_file_server": true}.
+It is validated on save and compiled once into predicates; each predicate knows
+the project fields it reads and evaluates either for one project or as a
+boolean mask over arrays of projects. All predicates of a material must hold.
+"""
+import json
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ConditionError(ValueError):
+    """Raised when a conditions dict contains an unknown key or an invalid value"""
+
+
+# Variables read by conditions, with the project fields each one reads
+CONDITION_VARIABLES = {
+    'users': ['number_of_users'],
+    'office_pcs': ['num_laptop_office', 'num_desktop_office'],
+    'videoconference': ['num_videoconference'],
+    'file_server': ['file_server'],
+    'local_apps': ['local_apps'],
+}
+
+# Condition key -> (kind, variable)
+#   min:  variable >= value (non-negative integer)
+#   max:  variable <= value (non-negative integer)
+#   flag: variable is set (true) or not set (false)
+CONDITION_KEYS = {
+    'min_users': ('min', 'users'),
+    'max_users': ('max', 'users'),
+    'min_servers': ('min', 'office_pcs'),
+    'has_videoconference': ('flag', 'videoconference'),
+    'has_file_server': ('flag', 'file_server'),
+    'has_local_apps': ('flag', 'local_apps'),
+}
+
+
+def project_condition_values(project):
+    """Condition variables of one project"""
+    return {
+        'users': project.number_of_users,
+        'office_pcs': project.num_laptop_office + project.num_desktop_office,
+        'videoconference': project.num_videoconference,
+        'file_server': int(bool(project.file_server)),
+        'local_apps': int(bool(project.local_apps)),
+    }
+
+
+def project_condition_arrays(projects):
+    """Condition variables of many projects, as one integer array per variable"""
+    rows = [project_condition_values(project) for project in projects]
+    return {
+        name: np.array([row[name] for row in rows], dtype=np.int64)
+        for name in CONDITION_VARIABLES
+    }
+
+
+class ConditionPredicate:
+    """One compiled condition, e.g. min_users >= 100"""
+
+    def __init__(self, key, value):
+        if key not in CONDITION_KEYS:
+            raise ConditionError(
+                f"Unknown condition '{key}' (allowed: {', '.join(sorted(CONDITION_KEYS))})"
+            )
+        self.key = key
+        self.kind, self.variable = CONDITION_KEYS[key]
+
+        if self.kind == 'flag':
+            # Rows written before validation may hold 0/1 for false/true
+            if type(value) is int and value in (0, 1):
+                value = bool(value)
+            if not isinstance(value, bool):
+                raise ConditionError(f"Condition '{key}' expects true or false, got {value!r}")
+        elif isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ConditionError(f"Condition '{key}' expects a non-negative integer, got {value!r}")
+        self.value = value
+
+    def __repr__(self):
+        return f'ConditionPredicate({self.key!r}, {self.value!r})'
+
+    @property
+    def fields(self):
+        """Project fields read by the predicate"""
+        return set(CONDITION_VARIABLES[self.variable])
+
+    def evaluate(self, values):
+        """Evaluate for one project, given its project_condition_values() dict"""
+        value = values[self.variable]
+        if self.kind == 'min':
+            return value >= self.value
+        if self.kind == 'max':
+            return value <= self.value
+        return bool(value) == self.value
+
+    def evaluate_many(self, arrays):
+        """Boolean mask over many projects, given project_condition_arrays()"""
+        array = arrays[self.variable]
+        if self.kind == 'min':
+            return array >= self.value
+        if self.kind == 'max':
+            return array <= self.value
+        return (array != 0) == self.value
+
+
+class InvalidCondition:
+    """A stored condition that cannot be compiled: it never holds, so the material is left out"""
+
+    fields = frozenset()
+    variable = None
+
+    def __init__(self, key, value, error):
+        self.key = key
+        self.value = value
+        self.error = error
+
+    def __repr__(self):
+        return f'InvalidCondition({self.key!r}, {self.value!r})'
+
+    def evaluate(self, values):
+        return False
+
+    def evaluate_many(self, arrays):
+        size = len(next(iter(arrays.values()))) if arrays else 0
+        return np.zeros(size, dtype=bool)
+
+
+class CompiledConditions:
+    """All predicates of one conditions dict (an empty dict always holds)"""
+
+    def __init__(self, predicates):
+        self.predicates = list(predicates)
+
+    @property
+    def fields(self):
+        """Project fields read by any of the predicates"""
+        fields = set()
+        for predicate in self.predicates:
+            fields.update(predicate.fields)
+        return fields
+
+    @property
+    def variables(self):
+        return {predicate.variable for predicate in self.predicates if predicate.variable is not None}
+
+    def evaluate(self, values):
+        return all(predicate.evaluate(values) for predicate in self.predicates)
+
+    def evaluate_many(self, arrays):
+        size = len(next(iter(arrays.values()))) if arrays else 0
+        mask = np.ones(size, dtype=bool)
+        for predicate in self.predicates:
+            mask &= predicate.evaluate_many(arrays)
+        return mask
+
+
+_compiled_conditions = {}
+
+
+def validate_conditions(conditions):
+    """Compile a conditions dict, raising ConditionError on the first problem"""
+    if not isinstance(conditions, dict):
+        raise ConditionError('Conditions must be an object, e.g. {"min_users": 50}')
+    return CompiledConditions(ConditionPredicate(key, value) for key, value in conditions.items())
+
+
+def compile_conditions(conditions):
+    """
+    Compiled predicates of a stored conditions dict, cached by content.
+
+    Rows saved before conditions were validated may still hold invalid entries.
+    Those are logged and compiled to a condition that never holds: a material
+    whose conditions cannot be understood is left out rather than added to
+    every project.
+    """
+    try:
+        cache_key = json.dumps(conditions, sort_keys=True)
+    except TypeError:
+        cache_key = None
+    compiled = _compiled_conditions.get(cache_key) if cache_key is not None else None
+    if compiled is not None:
+        return compiled
+
+    predicates = []
+    if not isinstance(conditions, dict):
+        if conditions:
+            logger.warning('Material conditions are not an object: %r', conditions)
+            predicates.append(InvalidCondition(None, conditions, 'not an object'))
+        conditions = {}
+    for key, value in conditions.items():
+        try:
+            predicates.append(ConditionPredicate(key, value))
+        except ConditionError as e:
+            logger.warning('Material condition never holds: %s', e)
+            predicates.append(InvalidCondition(key, value, str(e)))
+    compiled = CompiledConditions(predicates)
+    if cache_key is not None:
+        _compiled_conditions[cache_key] = compiled
+    return compiled
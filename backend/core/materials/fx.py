@@ -0,0 +1,199 @@
+"""
+Exchange rate service.
+
+Rates are fetched by a provider and stored in the ExchangeRate table; everything
+else (Material.save included) only reads the stored rate and never waits on the
+network. Refreshes are single-flight across processes (a lock row per currency
+pair) and failures are cached for FX_FAILURE_BACKOFF seconds so a provider
+outage does not cause a retry on every call.
+
+Settings:
+    FX_RATE_PROVIDER      dotted path of the provider class (default: ExchangeRateAPIProvider)
+    FX_STATIC_RATES       {"EUR/MAD": "10.80"} rates served by StaticFXProvider
+    FX_MAX_AGE            seconds after which a stored rate is refreshed (default: 3600)
+    FX_FAILURE_BACKOFF    seconds to wait after a failed refresh (default: 600)
+    FX_BACKGROUND_REFRESH refresh stale rates in a background thread on read (default: False;
+                          rates are otherwise refreshed by `manage.py refresh_fx_rates` or refresh_rate())
+"""
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ExchangeRate, ExchangeRateRefresh
+
+logger = logging.getLogger(__name__)
+
+# Used until a first rate has been stored
+DEFAULT_RATES = {('EUR', 'MAD'): Decimal('10.5')}
+
+# A refresh lock older than this is considered abandoned
+REFRESH_LOCK_TIMEOUT = 60
+
+
+class FXProviderError(Exception):
+    """Raised by providers when a rate cannot be fetched"""
+
+
+class FXProvider(ABC):
+    """Interface of exchange rate providers"""
+    name = ''
+
+    @abstractmethod
+    def fetch_rate(self, base, quote):
+        """Return the base -> quote rate as a Decimal, or raise FXProviderError"""
+
+
+class ExchangeRateAPIProvider(FXProvider):
+    """Rates from exchangerate-api.com"""
+    name = 'exchangerate-api'
+    url = 'https://api.exchangerate-api.com/v4/latest/{base}'
+    timeout = 8
+
+    def fetch_rate(self, base, quote):
+        import requests
+        try:
+            resp = requests.get(self.url.format(base=base), timeout=self.timeout)
+            resp.raise_for_status()
+            rate = resp.json().get('rates', {}).get(quote)
+        except (requests.RequestException, ValueError) as e:
+            raise FXProviderError(str(e))
+        if rate is None:
+            raise FXProviderError(f'{quote} rate missing')
+        return Decimal(str(rate))
+
+
+class StaticFXProvider(FXProvider):
+    """Fixed rates from settings.FX_STATIC_RATES, for tests and offline deployments"""
+    name = 'static'
+
+    def fetch_rate(self, base, quote):
+        rates = getattr(settings, 'FX_STATIC_RATES', {})
+        rate = rates.get(f'{base}/{quote}', DEFAULT_RATES.get((base, quote)))
+        if rate is None:
+            raise FXProviderError(f'No static rate for {base}/{quote}')
+        return Decimal(str(rate))
+
+
+def get_provider():
+    path = getattr(settings, 'FX_RATE_PROVIDER', 'materials.fx.ExchangeRateAPIProvider')
+    return import_string(path)()
+
+
+def get_stored_rate(base='EUR', quote='MAD'):
+    """Latest stored ExchangeRate row of a pair, or None"""
+    return ExchangeRate.objects.filter(base_currency=base, quote_currency=quote).first()
+
+
+def get_rate(base='EUR', quote='MAD'):
+    """
+    Current rate of a pair, read from the database only.
+    A stale rate is still returned; a background refresh is started if enabled.
+    """
+    stored = get_stored_rate(base, quote)
+    if stored is None or timezone.now() - stored.fetched_at > timedelta(seconds=_max_age()):
+        if getattr(settings, 'FX_BACKGROUND_REFRESH', False):
+            refresh_in_background(base, quote)
+    if stored is None:
+        return DEFAULT_RATES.get((base, quote), Decimal('1'))
+    return stored.rate
+
+
+_background_refreshes = set()
+_background_lock = threading.Lock()
+
+
+def refresh_in_background(base='EUR', quote='MAD'):
+    """Start refresh_rate() in a daemon thread, at most one per pair in this process"""
+    with _background_lock:
+        if (base, quote) in _background_refreshes:
+            return
+        _background_refreshes.add((base, quote))
+
+    def run():
+        try:
+            refresh_rate(base, quote)
+        except Exception:
+            logger.exception('Background FX refresh of %s/%s failed', base, quote)
+        finally:
+            connection.close()
+            with _background_lock:
+                _background_refreshes.discard((base, quote))
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def refresh_rate(base='EUR', quote='MAD', provider=None, force=False):
+    """
+    Fetch and store a new rate for a pair.
+
+    Returns the new ExchangeRate, or None when skipped: another process is already
+    refreshing the pair, the stored rate is still fresh, or the last attempt failed
+    less than FX_FAILURE_BACKOFF seconds ago (force=True bypasses the last two).
+    Provider failures are recorded, not raised; other errors are recorded, then raised.
+    """
+    now = timezone.now()
+    if not force:
+        stored = get_stored_rate(base, quote)
+        if stored is not None and now - stored.fetched_at <= timedelta(seconds=_max_age()):
+            return None
+
+    state = _refresh_state(base, quote)
+    if not force and state.last_error and state.last_attempt_at and \
+            now - state.last_attempt_at < timedelta(seconds=_failure_backoff()):
+        return None
+
+    # Single flight: claim the lock row with a conditional update
+    claimed = ExchangeRateRefresh.objects.filter(pk=state.pk).filter(
+        Q(refreshing_since__isnull=True) |
+        Q(refreshing_since__lt=now - timedelta(seconds=REFRESH_LOCK_TIMEOUT))
+    ).update(refreshing_since=now)
+    if not claimed:
+        return None
+
+    provider = provider or get_provider()
+    outcome = {}
+    try:
+        rate = provider.fetch_rate(base, quote)
+        exchange_rate = ExchangeRate.objects.create(
+            base_currency=base, quote_currency=quote, rate=rate, provider=provider.name,
+        )
+        outcome = {'last_attempt_at': timezone.now(), 'last_error': '', 'failure_count': 0}
+    except Exception as e:
+        # Malformed payloads, provider bugs and database errors are recorded too, then raised
+        outcome = {
+            'last_attempt_at': timezone.now(), 'last_error': (str(e) or type(e).__name__)[:1000],
+            'failure_count': state.failure_count + 1,
+        }
+        if not isinstance(e, FXProviderError):
+            raise
+        logger.warning('FX refresh of %s/%s failed: %s', base, quote, e)
+        return None
+    finally:
+        # Always release the lock row, whatever failed
+        ExchangeRateRefresh.objects.filter(pk=state.pk).update(refreshing_since=None, **outcome)
+    return exchange_rate
+
+
+def _refresh_state(base, quote):
+    try:
+        state, _ = ExchangeRateRefresh.objects.get_or_create(base_currency=base, quote_currency=quote)
+    except IntegrityError:
+        # Created concurrently by another process
+        state = ExchangeRateRefresh.objects.get(base_currency=base, quote_currency=quote)
+    return state
+
+
+def _max_age():
+    return getattr(settings, 'FX_MAX_AGE', 3600)
+
+
+def _failure_backoff():
+    return getattr(settings, 'FX_FAILURE_BACKOFF', 600)
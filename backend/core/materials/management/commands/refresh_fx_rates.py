@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from materials.fx import get_provider, get_stored_rate, refresh_rate
+from materials.models import ExchangeRateRefresh
+
+
+class Command(BaseCommand):
+    help = 'Fetch and store exchange rates (run periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pairs',
+            type=str,
+            default='EUR/MAD',
+            help='Comma-separated currency pairs to refresh (default: EUR/MAD)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Refresh even if the stored rate is fresh or the last attempt failed recently',
+        )
+        parser.add_argument(
+            '--provider',
+            type=str,
+            help='Dotted path of the provider class (default: settings.FX_RATE_PROVIDER)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            provider = import_string(options['provider'])() if options['provider'] else get_provider()
+        except ImportError as e:
+            raise CommandError(f'Invalid provider: {e}')
+
+        for pair in options['pairs'].split(','):
+            try:
+                base, quote = (currency.strip().upper() for currency in pair.split('/'))
+            except ValueError:
+                raise CommandError(f'Invalid currency pair: {pair}')
+
+            exchange_rate = refresh_rate(base, quote, provider=provider, force=options['force'])
+            if exchange_rate is not None:
+                self.stdout.write(self.style.SUCCESS(
+                    f'{base}/{quote}: {exchange_rate.rate} ({exchange_rate.provider})'
+                ))
+                continue
+
+            state = ExchangeRateRefresh.objects.filter(base_currency=base, quote_currency=quote).first()
+            stored = get_stored_rate(base, quote)
+            current = f'{stored.rate} from {stored.fetched_at:%Y-%m-%d %H:%M}' if stored else 'none'
+            if state is not None and state.last_error:
+                self.stdout.write(self.style.WARNING(
+                    f'{base}/{quote}: not refreshed, last error: {state.last_error} (stored rate: {current})'
+                ))
+            else:
+                self.stdout.write(f'{base}/{quote}: not refreshed (stored rate: {current})')
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from calculations.services import MoroccoRepricer
+from materials.models import ExchangeRate, Material
+
+
+class Command(BaseCommand):
+    help = 'Recompute price_morocco of all eligible materials from a stored EUR/MAD rate'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rate-id',
+            type=int,
+            help='ExchangeRate id to use (default: latest stored EUR/MAD rate)',
+        )
+        parser.add_argument(
+            '--category',
+            type=str,
+            help='Only reprice the materials of this category (name)',
+        )
+        parser.add_argument(
+            '--reason',
+            type=str,
+            default='',
+            help='Reason recorded in the price history',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the new prices and affected projects without writing anything',
+        )
+        parser.add_argument(
+            '--no-propagate',
+            action='store_true',
+            help='Do not re-cost the stored budgets of the affected projects',
+        )
+
+    def handle(self, *args, **options):
+        rates = ExchangeRate.objects.filter(base_currency='EUR', quote_currency='MAD')
+        if options['rate_id']:
+            exchange_rate = rates.filter(pk=options['rate_id']).first()
+            if exchange_rate is None:
+                raise CommandError(f"EUR/MAD rate {options['rate_id']} not found")
+        else:
+            exchange_rate = rates.first()
+            if exchange_rate is None:
+                raise CommandError('No stored EUR/MAD rate, run refresh_fx_rates first')
+
+        materials = Material.objects.all()
+        if options['category']:
+            materials = materials.filter(category__name=options['category'])
+
+        result = MoroccoRepricer.reprice(
+            exchange_rate,
+            materials=materials,
+            reason=options['reason'],
+            propagate=not options['no_propagate'],
+            dry_run=options['dry_run'],
+        )
+
+        for change in result['materials']:
+            self.stdout.write(
+                f"  {change['material_name']}: MAD {change['old_price_morocco']} -> {change['new_price_morocco']}"
+            )
+        for project in result['affected_projects']:
+            self.stdout.write(f"  Affected project: {project['name']} (ID: {project['id']})")
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Repriced {result['materials_updated']} materials at EUR/MAD {exchange_rate.rate}; "
+            f"{len(result['affected_projects'])} projects affected, {result['items_updated']} budget items updated"
+        ))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0006_catalogversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_currency', models.CharField(max_length=3)),
+                ('quote_currency', models.CharField(max_length=3)),
+                ('rate', models.DecimalField(decimal_places=6, max_digits=12)),
+                ('provider', models.CharField(blank=True, max_length=100)),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-fetched_at'],
+                'indexes': [models.Index(fields=['base_currency', 'quote_currency', '-fetched_at'], name='materials_e_base_cu_4b8c01_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExchangeRateRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_currency', models.CharField(max_length=3)),
+                ('quote_currency', models.CharField(max_length=3)),
+                ('refreshing_since', models.DateTimeField(blank=True, null=True)),
+                ('last_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('failure_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('base_currency', 'quote_currency')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+FLAG_CONDITIONS = ['has_videoconference', 'has_file_server', 'has_local_apps']
+
+
+def coerce_condition_flags(apps, schema_editor):
+    """Store legacy 0/1 values of flag conditions as booleans"""
+    Material = apps.get_model('materials', 'Material')
+    for material in Material.objects.exclude(conditions={}).only('pk', 'conditions'):
+        conditions = material.conditions
+        if not isinstance(conditions, dict):
+            continue
+        legacy = [
+            key for key in FLAG_CONDITIONS
+            if type(conditions.get(key)) is int and conditions[key] in (0, 1)
+        ]
+        if legacy:
+            conditions.update({key: bool(conditions[key]) for key in legacy})
+            Material.objects.filter(pk=material.pk).update(conditions=conditions)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0007_exchangerate'),
+    ]
+
+    operations = [
+        migrations.RunPython(coerce_condition_flags, migrations.RunPython.noop),
+    ]
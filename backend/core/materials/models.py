@@ -1,38 +1,38 @@
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from decimal import Decimal, ROUND_HALF_UP
 from django.utils import timezone
-import requests
-import threading
 
-# EUR to MAD conversion cache
-_EUR_MAD_CACHE = {"rate": None, "ts": None}
-_EUR_MAD_TTL = 3600  # 1 hour
-_FX_URL = "https://api.exchangerate-api.com/v4/latest/EUR"
-_lock = threading.Lock()
 
 def _quant2(val: Decimal) -> Decimal:
     return (Decimal(val or 0)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
 def _get_eur_mad_rate() -> Decimal:
-    now = timezone.now()
-    if _EUR_MAD_CACHE["rate"] and _EUR_MAD_CACHE["ts"] and (now - _EUR_MAD_CACHE["ts"]).total_seconds() < _EUR_MAD_TTL:
-        return _EUR_MAD_CACHE["rate"]
-    try:
-        resp = requests.get(_FX_URL, timeout=8)
-        resp.raise_for_status()
-        data = resp.json()
-        rate = data.get("rates", {}).get("MAD")
-        if rate is None:
-            raise ValueError("MAD rate missing")
-        rate_dec = Decimal(str(rate))
-        with _lock:
-            _EUR_MAD_CACHE["rate"] = rate_dec
-            _EUR_MAD_CACHE["ts"] = now
-        return rate_dec
-    except Exception:
-        # Fallback to a default rate if API fails
-        return Decimal("10.5")
+    # Locally stored rate only, never an HTTP call; see materials.fx and the refresh_fx_rates command
+    from .fx import get_rate
+    return get_rate("EUR", "MAD")
+
+
+class CatalogVersion(models.Model):
+    """Single-row counter bumped whenever the material catalog changes"""
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Catalog v{self.version}"
+    
+    @classmethod
+    def current(cls):
+        """Return the current catalog version (0 if the catalog was never changed)"""
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+    
+    @classmethod
+    def bump(cls):
+        """Increment the catalog version; call after any change to materials or prices"""
+        updated = cls.objects.filter(pk=1).update(version=models.F('version') + 1, updated_at=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
 
 
 class Category(models.Model):
@@ -47,6 +47,20 @@ class Category(models.Model):
     
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        renamed = self.pk is not None and Category.objects.filter(pk=self.pk).exclude(name=self.name).exists()
+        super().save(*args, **kwargs)
+        if renamed:
+            # Stored budget breakdowns are grouped by category name
+            from projects.models import Project
+            Project.objects.filter(items__material__category=self).update(budget_breakdown=None)
+        CatalogVersion.bump()
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        CatalogVersion.bump()
+        return result
 
 
 class Material(models.Model):
@@ -116,13 +130,43 @@ class Material(models.Model):
     def __str__(self):
         return f"{self.name} ({self.category.name})"
     
+    def clean(self):
+        self.validate_conditions()
+    
+    def validate_conditions(self):
+        """Reject unknown condition keys and invalid values; legacy 0/1 flags are stored as booleans"""
+        from .conditions import ConditionError, validate_conditions
+        try:
+            compiled = validate_conditions(self.conditions)
+        except ConditionError as e:
+            raise ValidationError({'conditions': str(e)})
+        self.conditions = {predicate.key: predicate.value for predicate in compiled.predicates}
+    
     def save(self, *args, **kwargs):
+        self.validate_conditions()
+        
         # Auto-convert EUR to MAD if MAD is 0 or not set
         if self.price_france and (not self.price_morocco or self.price_morocco == 0):
             rate = _get_eur_mad_rate()
             self.price_morocco = _quant2(Decimal(self.price_france) * rate)
         
+        relabeled = self.pk is not None and Material.objects.filter(pk=self.pk).exclude(
+            name=self.name, category_id=self.category_id
+        ).exists()
         super().save(*args, **kwargs)
+        if relabeled:
+            # Stored budget breakdowns hold the material and category names
+            from projects.models import Project
+            Project.objects.filter(items__material=self).update(budget_breakdown=None)
+        CatalogVersion.bump()
+    
+    def delete(self, *args, **kwargs):
+        # Budget lines of this material are deleted with it
+        from projects.models import Project
+        Project.objects.filter(items__material=self).update(budget_breakdown=None)
+        result = super().delete(*args, **kwargs)
+        CatalogVersion.bump()
+        return result
     
     @property
     def price_difference_percentage(self):
@@ -149,3 +193,35 @@ class PriceHistory(models.Model):
     def __str__(self):
         return f"{self.material.name} - {self.changed_at.strftime('%Y-%m-%d')}"
 
+
+
+class ExchangeRate(models.Model):
+    """Exchange rates fetched by the FX refresh job; the latest row per pair is the current rate"""
+    base_currency = models.CharField(max_length=3)
+    quote_currency = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=12, decimal_places=6)
+    provider = models.CharField(max_length=100, blank=True)
+    fetched_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-fetched_at']
+        indexes = [models.Index(fields=['base_currency', 'quote_currency', '-fetched_at'])]
+    
+    def __str__(self):
+        return f"{self.base_currency}/{self.quote_currency} {self.rate} ({self.fetched_at:%Y-%m-%d %H:%M})"
+
+
+class ExchangeRateRefresh(models.Model):
+    """Refresh state of one currency pair: single-flight lock and last failure (negative cache)"""
+    base_currency = models.CharField(max_length=3)
+    quote_currency = models.CharField(max_length=3)
+    refreshing_since = models.DateTimeField(null=True, blank=True)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    failure_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['base_currency', 'quote_currency']
+    
+    def __str__(self):
+        return f"{self.base_currency}/{self.quote_currency} refresh"
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .conditions import ConditionError, validate_conditions
 from .models import Category, Material, PriceHistory
 
 
@@ -29,6 +30,13 @@ class MaterialSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'updated_at', 'price_difference_percentage']
     
+    def validate_conditions(self, value):
+        try:
+            validate_conditions(value)
+        except ConditionError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+    
     def validate(self, data):
         """Validate material data"""
         # Validate prices
@@ -108,6 +116,26 @@ class MaterialUpdateSerializer(serializers.ModelSerializer):
                 changed_by=self.context['request'].user if 'request' in self.context else None,
                 reason=reason
             )
+            
+            # Re-cost the stored budgets that contain this material
+            from calculations.services import PriceChangePropagator
+            PriceChangePropagator.propagate([instance.pk])
         
         return instance
 
+
+
+class ExchangeRateQuerySerializer(serializers.Serializer):
+    """Query parameters of the exchange rate list"""
+    base = serializers.RegexField(r'^[A-Za-z]{3}$', required=False, default='EUR')
+    quote = serializers.RegexField(r'^[A-Za-z]{3}$', required=False, default='MAD')
+
+
+class MoroccoRepricingSerializer(serializers.Serializer):
+    """Options of a bulk MAD repricing"""
+    rate_id = serializers.IntegerField(required=False, allow_null=True)
+    category_id = serializers.IntegerField(required=False, allow_null=True)
+    material_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=True)
+    reason = serializers.CharField(required=False, allow_blank=True, default='')
+    dry_run = serializers.BooleanField(required=False, default=False)
+    propagate = serializers.BooleanField(required=False, default=True)
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from calculations.engine import QuantityEngine
+from calculations.services import ProjectCalculator
+from materials.conditions import ConditionError, compile_conditions, validate_conditions
+from materials.models import Category, Material
+from projects.models import Project
+
+
+class MaterialConditionTests(TestCase):
+    """Stored conditions are validated, and never widened when they cannot be understood"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Infrastructure')
+        cls.projects = [
+            Project(name='Small', number_of_users=10, file_server=False),
+            Project(name='Server', number_of_users=10, file_server=True),
+        ]
+
+    def conditional_material(self, name, conditions):
+        material = Material(
+            name=name, category=self.category, price_france=Decimal('10.00'), price_morocco=Decimal('108.00'),
+            calculation_type='CONDITIONAL', multiplier=Decimal('1'), conditions=conditions,
+        )
+        # Bypass validation, like rows written before conditions were validated
+        Material.objects.bulk_create([material])
+        return Material.objects.get(name=name)
+
+    def included(self, material):
+        calculator = ProjectCalculator()
+        scalar = [calculator._calculate_material_quantity(material, project) > 0 for project in self.projects]
+        vectorized = [bool(quantity) for quantity in QuantityEngine([material]).quantities(self.projects)[:, 0]]
+        self.assertEqual(scalar, vectorized)
+        return scalar
+
+    def test_legacy_integer_flags_are_accepted(self):
+        material = self.conditional_material('Backup unit', {'has_file_server': 1})
+        self.assertEqual(self.included(material), [False, True])
+
+        material.price_france = Decimal('12.00')
+        material.save()
+        material.refresh_from_db()
+        self.assertIs(material.conditions['has_file_server'], True)
+
+    def test_invalid_stored_condition_excludes_the_material(self):
+        for conditions in [{'has_file_server': 'yes'}, {'min_users': -1}, {'unknown_key': 3}, ['min_users']]:
+            with self.subTest(conditions=conditions):
+                material = self.conditional_material(f'Material {conditions!r}', conditions)
+                with self.assertLogs('materials.conditions', 'WARNING'):
+                    self.assertEqual(self.included(material), [False, False])
+
+    def test_invalid_conditions_are_rejected_on_save(self):
+        material = self.conditional_material('Firewall', {})
+        material.conditions = {'has_file_server': 2}
+        with self.assertRaises(ValidationError):
+            material.save()
+        with self.assertRaises(ConditionError):
+            validate_conditions({'min_users': True})
+
+    def test_compiled_conditions_are_cached(self):
+        self.assertIs(compile_conditions({'min_users': 5}), compile_conditions({'min_users': 5}))
@@ -9,6 +9,8 @@ urlpatterns = [
     path('materials/<int:pk>/', views.MaterialDetailView.as_view(), name='material-detail'),
     path('materials/<int:pk>/history/', views.MaterialPriceHistoryView.as_view(), name='material-price-history'),
     path('materials/bulk-update/', views.MaterialBulkUpdateView.as_view(), name='material-bulk-update'),
+    path('materials/reprice-morocco/', views.MaterialMoroccoRepricingView.as_view(), name='material-reprice-morocco'),
+    path('fx-rates/', views.ExchangeRateListView.as_view(), name='fx-rate-list'),
     path('materials/setup/', views.MaterialSetupView.as_view(), name='material-setup'),
     path('materials/setup-required/', views.MaterialSetupRequiredView.as_view(), name='material-setup-required'),
     path('materials/bulk-create/', views.MaterialBulkCreateView.as_view(), name='material-bulk-create'),
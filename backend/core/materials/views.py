@@ -8,12 +8,13 @@ from rest_framework.pagination import PageNumberPagination
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
 from django.db import transaction
-from .models import Category, Material, PriceHistory
+from .conditions import ConditionError, validate_conditions
+from .models import Category, ExchangeRate, Material, PriceHistory
 from .serializers import (
-    CategorySerializer, MaterialSerializer, MaterialListSerializer,
-    MaterialUpdateSerializer, PriceHistorySerializer
+    CategorySerializer, ExchangeRateQuerySerializer, MaterialSerializer, MaterialListSerializer,
+    MaterialUpdateSerializer, MoroccoRepricingSerializer, PriceHistorySerializer
 )
-from calculations.services import MaterialManager, ProjectCalculator
+from calculations.services import MaterialManager, MoroccoRepricer, PriceChangePropagator, ProjectCalculator
 from projects.models import Project
 
 
@@ -190,6 +191,7 @@ class MaterialBulkUpdateView(APIView):
         reason = request.data.get('reason', 'Bulk update')
         
         updated_materials = []
+        repriced_material_ids = []
         errors = []
         
         for update in updates:
@@ -224,6 +226,7 @@ class MaterialBulkUpdateView(APIView):
                         changed_by=request.user,
                         reason=reason
                     )
+                    repriced_material_ids.append(material.pk)
                 
                 updated_materials.append(material)
                 
@@ -232,13 +235,83 @@ class MaterialBulkUpdateView(APIView):
             except Exception as e:
                 errors.append(f"Error updating material {material_id}: {str(e)}")
         
+        # Re-cost the stored budgets that contain the repriced materials
+        propagation = PriceChangePropagator.propagate(repriced_material_ids)
+        
         return Response({
             'updated_count': len(updated_materials),
             'errors': errors,
-            'updated_materials': MaterialSerializer(updated_materials, many=True).data
+            'updated_materials': MaterialSerializer(updated_materials, many=True).data,
+            'affected_projects_count': len(propagation['project_ids']),
+            'updated_items_count': propagation['items_updated']
         })
 
 
+class ExchangeRateListView(APIView):
+    """Stored exchange rates, latest first (Admin only)"""
+    permission_classes = [IsAuthenticated, IsAdminOrSuperAdmin]
+    
+    def get(self, request):
+        serializer = ExchangeRateQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        rates = ExchangeRate.objects.filter(
+            base_currency=serializer.validated_data['base'].upper(),
+            quote_currency=serializer.validated_data['quote'].upper(),
+        )[:50]
+        return Response([
+            {
+                'id': rate.id,
+                'base_currency': rate.base_currency,
+                'quote_currency': rate.quote_currency,
+                'rate': rate.rate,
+                'provider': rate.provider,
+                'fetched_at': rate.fetched_at,
+            }
+            for rate in rates
+        ])
+
+
+class MaterialMoroccoRepricingView(APIView):
+    """Recompute all MAD prices from a stored EUR/MAD rate (Admin only)"""
+    permission_classes = [IsAuthenticated, IsAdminOrSuperAdmin]
+    
+    def post(self, request):
+        """
+        Body: rate_id (default: latest EUR/MAD rate), optional category_id or
+        material_ids to restrict the materials, reason, dry_run and propagate
+        (re-cost stored budgets, default true).
+        """
+        serializer = MoroccoRepricingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        
+        rates = ExchangeRate.objects.filter(base_currency='EUR', quote_currency='MAD')
+        rate_id = options.get('rate_id')
+        exchange_rate = get_object_or_404(rates, pk=rate_id) if rate_id else rates.first()
+        if exchange_rate is None:
+            return Response(
+                {'error': 'No stored EUR/MAD rate, run refresh_fx_rates first'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        materials = Material.objects.all()
+        if options.get('category_id'):
+            materials = materials.filter(category_id=options['category_id'])
+        if options.get('material_ids'):
+            materials = materials.filter(pk__in=options['material_ids'])
+        
+        result = MoroccoRepricer.reprice(
+            exchange_rate,
+            materials=materials,
+            user=request.user,
+            reason=options['reason'],
+            propagate=options['propagate'],
+            dry_run=options['dry_run'],
+        )
+        result['affected_projects_count'] = len(result['affected_projects'])
+        return Response(result)
+
+
 class MaterialSetupView(APIView):
     """Setup default materials and categories (Admin only)"""
     permission_classes = [IsAuthenticated, IsAdminOrSuperAdmin]
@@ -360,6 +433,15 @@ def add_custom_material(request):
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        # Reject unknown or invalid conditions before creating anything
+        try:
+            validate_conditions(data.get('conditions', {}))
+        except ConditionError as e:
+            return Response(
+                {'error': f'Invalid conditions: {e}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         # Create material
         material = Material.objects.create(
             name=data['name'],
@@ -416,6 +498,7 @@ def delete_custom_material(request, material_id):
             
             # Delete all project items that use this material
             deleted_items_count = project_items.count()
+            Project.objects.filter(items__material=material).update(budget_breakdown=None)
             project_items.delete()
             
             # Recalculate budgets for affected projects
@@ -478,7 +561,7 @@ def recalculate_project_budget(request, project_id):
         
         # Recalculate budget using the ProjectCalculator
         calculator = ProjectCalculator()
-        project_items, total_france, total_morocco = calculator.save_project_budget(project)
+        project_items, total_france, total_morocco = calculator.save_project_budget(project, force=True)
         
         return Response({
             'message': 'Budget recalculated successfully',
@@ -0,0 +1,126 @@
+"""
+Content-addressed cache of project budget workbooks.
+
+A workbook is stored once under MEDIA_ROOT/exports/cache/<key>.xlsx, where the
+key hashes everything the sheet is built from: the project's cost fingerprint
+and name, the state of its stored budget, the catalog version and the
+exporter's TEMPLATE_VERSION. An unchanged budget is then served from disk.
+
+Settings:
+    EXPORT_CACHE_MAX_BYTES  total size of the cache directory (default: 500 MB)
+    EXPORT_CACHE_MAX_AGE    seconds since a file was last served before it is evicted (default: 7 days)
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+from materials.models import CatalogVersion
+from calculations.services import project_fingerprint
+from .exporters import TEMPLATE_VERSION
+
+CACHE_SUBDIR = os.path.join('exports', 'cache')
+
+# Temporary files younger than this are exports being written by another process
+TMP_FILE_GRACE_PERIOD = 3600
+
+
+def cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, CACHE_SUBDIR)
+
+
+def export_cache_key(project, catalog_version=None):
+    """Hash of everything the budget workbook of a project depends on"""
+    if catalog_version is None:
+        catalog_version = CatalogVersion.current()
+    payload = json.dumps([
+        project_fingerprint(project),
+        project.name,
+        project.budget_fingerprint,
+        project.budget_catalog_version,
+        catalog_version,
+        TEMPLATE_VERSION,
+    ], default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_or_create_export(project, exporter, key=None, progress=None):
+    """
+    Path of the cached workbook of a project, built with exporter on a miss
+    (progress is passed to the exporter). Returns (key, path, hit).
+    """
+    key = key or export_cache_key(project)
+    path = os.path.join(cache_dir(), f'{key}.xlsx')
+    if os.path.exists(path):
+        # Mark as recently used for the eviction policy
+        try:
+            os.utime(path)
+            return key, path, True
+        except FileNotFoundError:
+            pass  # Evicted concurrently: rebuild
+
+    os.makedirs(cache_dir(), exist_ok=True)
+    # Build next to the final path and rename, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir(), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            exporter.generate_project_excel(project, f, progress=progress)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    evict()
+    return key, path, False
+
+
+def evict(max_bytes=None, max_age=None):
+    """
+    Delete cached workbooks not served for max_age seconds, then the least
+    recently served ones until the directory fits in max_bytes.
+    Returns the number of deleted files.
+    """
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'EXPORT_CACHE_MAX_BYTES', 500 * 1024 * 1024)
+    if max_age is None:
+        max_age = getattr(settings, 'EXPORT_CACHE_MAX_AGE', 7 * 24 * 3600)
+
+    entries = []
+    try:
+        with os.scandir(cache_dir()) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return 0
+
+    now = time.time()
+    deleted = 0
+    total = 0
+    # Most recently served first: keep while under both limits
+    for mtime, size, path in sorted(entries, reverse=True):
+        if path.endswith('.tmp'):
+            # In progress elsewhere: its os.replace() would fail. Abandoned ones are removed after the grace period
+            if now - mtime > TMP_FILE_GRACE_PERIOD:
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+            continue
+        if now - mtime > max_age or total + size > max_bytes:
+            try:
+                os.remove(path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            continue
+        total += size
+    return deleted
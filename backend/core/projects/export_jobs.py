@@ -0,0 +1,332 @@
+"""
+Background budget and portfolio exports.
+
+submit_export_job() and submit_portfolio_job() record an ExportJob and,
+unless a worker is already running, start a local worker process
+(`manage.py process_export_jobs`) that drains the queue and exits when it is
+empty. A worker holds an exclusive lock file for its lifetime, so a burst of
+submits starts one worker, not one per request. Workers claim jobs with a
+conditional UPDATE, so workers on other hosts (or a permanent
+`process_export_jobs --poll` worker) can run side by side. While a job runs, a
+timer thread bumps its heartbeat, so a long build or save is not mistaken for
+a dead worker.
+
+Identical requests are deduplicated: while a job is queued or running for the
+same project and export cache key, it is returned instead of a new one, and a
+finished job whose workbook is still cached is returned as it is. Portfolio
+jobs are deduplicated the same way per user, on portfolio_cache_key(); their
+files are written by the worker with its process pool (see projects.portfolio)
+and kept under PORTFOLIO_SUBDIR. Finished jobs, and their portfolio files, are
+deleted by the worker after EXPORT_JOB_RETENTION.
+
+Settings:
+    EXPORT_JOBS_SPAWN_WORKER  start a worker process on submit (default: True)
+    EXPORT_JOB_TIMEOUT        seconds without heartbeat after which a running job is retried (default: 300)
+    EXPORT_JOB_HEARTBEAT      seconds between heartbeats of a running job (default: EXPORT_JOB_TIMEOUT / 5)
+    EXPORT_JOB_RETENTION      seconds finished jobs are kept (default: 7 days)
+"""
+import logging
+import os
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .export_cache import cache_dir, export_cache_key, get_or_create_export
+from .exporters import ExcelExporter
+from .models import ExportJob, Project
+from .portfolio import portfolio_cache_key, write_portfolio
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: no worker lock, every submit starts a worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = [ExportJob.Status.QUEUED, ExportJob.Status.RUNNING]
+FINISHED_STATUSES = [ExportJob.Status.DONE, ExportJob.Status.FAILED]
+
+PORTFOLIO_SUBDIR = os.path.join('exports', 'portfolios')
+
+
+def submit_export_job(project, user=None):
+    """
+    Return (job, created) for an export of the project's budget workbook.
+    An active job for the same workbook is reused; a cached workbook gives a done job.
+    """
+    key = export_cache_key(project)
+    jobs = ExportJob.objects.filter(project=project, cache_key=key)
+    existing = jobs.filter(status__in=ACTIVE_STATUSES).first()
+    if existing is not None:
+        return existing, False
+
+    path = os.path.join(cache_dir(), f'{key}.xlsx')
+    if os.path.exists(path):
+        done = jobs.filter(status=ExportJob.Status.DONE, file_path=path).order_by('-finished_at').first()
+        if done is not None:
+            return done, False
+        now = timezone.now()
+        job = ExportJob.objects.create(
+            project=project, requested_by=user, cache_key=key, status=ExportJob.Status.DONE,
+            progress=100, file_path=path, started_at=now, finished_at=now,
+        )
+        return job, True
+
+    try:
+        with transaction.atomic():
+            job = ExportJob.objects.create(project=project, requested_by=user, cache_key=key)
+    except IntegrityError:
+        # Created concurrently by an identical request
+        existing = jobs.filter(status__in=ACTIVE_STATUSES).first()
+        if existing is None:
+            raise
+        return existing, False
+
+    if getattr(settings, 'EXPORT_JOBS_SPAWN_WORKER', True):
+        transaction.on_commit(start_worker)
+    return job, True
+
+
+def submit_portfolio_job(projects, file_format, user=None):
+    """
+    Return (job, created) for a portfolio export of projects (in order).
+    An active job of the same user for the same file is reused, as is a finished one whose file is kept.
+    """
+    key = portfolio_cache_key(projects, file_format)
+    jobs = ExportJob.objects.filter(kind=ExportJob.Kind.PORTFOLIO, requested_by=user, cache_key=key)
+    existing = jobs.filter(status__in=ACTIVE_STATUSES).first()
+    if existing is not None:
+        return existing, False
+    done = jobs.filter(status=ExportJob.Status.DONE).order_by('-finished_at').first()
+    if done is not None and os.path.exists(done.file_path):
+        return done, False
+
+    job = ExportJob.objects.create(
+        kind=ExportJob.Kind.PORTFOLIO, requested_by=user, cache_key=key,
+        params={'project_ids': [project.pk for project in projects], 'format': file_format},
+    )
+    if getattr(settings, 'EXPORT_JOBS_SPAWN_WORKER', True):
+        transaction.on_commit(start_worker)
+    return job, True
+
+
+@contextmanager
+def worker_lock():
+    """
+    Try to take the exclusive lock of the local export worker; yields whether
+    it was acquired. The lock is released on exit, or by the OS if the worker dies.
+    """
+    if fcntl is None:
+        yield True
+        return
+    path = os.path.join(settings.MEDIA_ROOT, 'exports', 'export_worker.lock')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def start_worker():
+    """Start a detached `manage.py process_export_jobs` process, unless a worker holds the lock"""
+    # A worker that fails to take the lock because of this check exits, but then the check succeeds
+    with worker_lock() as acquired:
+        if not acquired:
+            return
+    try:
+        subprocess.Popen(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'process_export_jobs'],
+            cwd=settings.BASE_DIR,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        logger.exception('Could not start an export worker')
+
+
+def claimable_jobs(now=None):
+    """Queued jobs, and running jobs whose worker stopped sending heartbeats"""
+    timeout = timedelta(seconds=getattr(settings, 'EXPORT_JOB_TIMEOUT', 300))
+    return ExportJob.objects.filter(
+        Q(status=ExportJob.Status.QUEUED) |
+        Q(status=ExportJob.Status.RUNNING, heartbeat_at__lt=(now or timezone.now()) - timeout)
+    )
+
+
+def claim_next_job():
+    """
+    Claim the oldest queued job, or a running job whose worker stopped sending
+    heartbeats, for this worker. Returns the job or None.
+    """
+    while True:
+        now = timezone.now()
+        claimable = claimable_jobs(now)
+        job = claimable.order_by('created_at', 'pk').first()
+        if job is None:
+            return None
+
+        # Conditional update: only one worker wins the claim
+        claimed = claimable.filter(pk=job.pk, status=job.status, heartbeat_at=job.heartbeat_at).update(
+            status=ExportJob.Status.RUNNING, started_at=now, heartbeat_at=now, progress=0, error='',
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+@contextmanager
+def heartbeat(job):
+    """Bump the heartbeat of a running job on a timer, whatever the export is doing"""
+    interval = getattr(settings, 'EXPORT_JOB_HEARTBEAT', getattr(settings, 'EXPORT_JOB_TIMEOUT', 300) / 5)
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                ExportJob.objects.filter(pk=job.pk, status=ExportJob.Status.RUNNING).update(
+                    heartbeat_at=timezone.now(),
+                )
+        except Exception:
+            logger.exception('Heartbeat of export job %s failed', job.pk)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'export-job-{job.pk}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job, exporter=None):
+    """Build (or fetch from the cache) the workbook of a claimed job and record the outcome"""
+    exporter = exporter or ExcelExporter(write_only=True)
+    reported = [0]
+
+    def progress(fraction):
+        percent = int(fraction * 100)
+        # A few writes per export: every 5% is plenty for polling clients
+        if percent >= reported[0] + 5 and percent < 100:
+            reported[0] = percent
+            ExportJob.objects.filter(pk=job.pk).update(progress=percent)
+
+    try:
+        with heartbeat(job):
+            if job.kind == ExportJob.Kind.PORTFOLIO:
+                key, path = job.cache_key, build_portfolio(job, progress)
+            else:
+                # Keyed on the project as it is now, in case it changed since the job was queued
+                key, path, _ = get_or_create_export(job.project, exporter, progress=progress)
+    except Exception as e:
+        logger.exception('Export job %s failed', job.pk)
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=ExportJob.Status.FAILED, error=str(e)[:1000], finished_at=timezone.now(),
+        )
+        return False
+
+    ExportJob.objects.filter(pk=job.pk).update(
+        status=ExportJob.Status.DONE, progress=100, cache_key=key, file_path=path, finished_at=timezone.now(),
+    )
+    return True
+
+
+def build_portfolio(job, progress=None):
+    """Write the portfolio file of a job, in worker processes; returns its path"""
+    project_ids = job.params['project_ids']
+    by_id = Project.objects.defer('budget_breakdown').in_bulk(project_ids)
+    # Projects deleted since the job was queued are left out
+    projects = [by_id[pk] for pk in project_ids if pk in by_id]
+    if not projects:
+        raise ValueError('None of the projects of this portfolio exist anymore')
+
+    file_format = job.params['format']
+    path = os.path.join(settings.MEDIA_ROOT, PORTFOLIO_SUBDIR, f'portfolio_{job.pk}.{file_format}')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside, so a download never sees a partial file
+    tmp_path = f'{path}.tmp'
+    write_portfolio(projects, tmp_path, file_format, progress=progress)
+    os.replace(tmp_path, path)
+    return path
+
+
+def process_jobs():
+    """Run claimable jobs until the queue is empty; returns the number of jobs run"""
+    exporter = ExcelExporter(write_only=True)
+    count = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            prune_jobs()
+            return count
+        run_job(job, exporter)
+        count += 1
+
+
+def run_worker():
+    """
+    Process jobs under the worker lock; returns the number of jobs run, 0 when
+    another worker holds the lock.
+    """
+    count = 0
+    while True:
+        with worker_lock() as acquired:
+            if not acquired:
+                return count
+            count += process_jobs()
+        # A job submitted while the lock was still held started no worker: take it from here
+        if not claimable_jobs().exists():
+            return count
+
+
+def prune_jobs():
+    """Delete jobs finished more than EXPORT_JOB_RETENTION ago, with their portfolio files; returns the number deleted"""
+    retention = timedelta(seconds=getattr(settings, 'EXPORT_JOB_RETENTION', 7 * 24 * 3600))
+    expired = ExportJob.objects.filter(status__in=FINISHED_STATUSES, finished_at__lt=timezone.now() - retention)
+    # Project workbooks belong to the export cache, which evicts them itself
+    portfolio_files = expired.filter(kind=ExportJob.Kind.PORTFOLIO).exclude(file_path='')
+    for path in portfolio_files.values_list('file_path', flat=True):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    deleted, _ = expired.delete()
+    return deleted
+
+
+def job_data(job, request=None):
+    """JSON-ready status of a job, with a download link once it is done"""
+    download_url = None
+    if job.status == ExportJob.Status.DONE:
+        download_url = reverse('project-export-job-download', args=[job.pk])
+        if request is not None:
+            download_url = request.build_absolute_uri(download_url)
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'project_id': job.project_id,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'download_url': download_url,
+    }
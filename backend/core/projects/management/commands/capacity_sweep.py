@@ -0,0 +1,124 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.models import Project
+from projects.serializers import ProjectCreateSerializer
+from calculations.services import CapacitySweep
+
+
+class Command(BaseCommand):
+    help = 'Budget curves of a base project spec over a grid of user counts, laptop/desktop mix or internet lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--spec',
+            type=str,
+            help='Base project spec as a JSON string (ProjectCreateSerializer fields)',
+        )
+        parser.add_argument(
+            '--file',
+            type=str,
+            help='Path to a JSON file containing the base project spec',
+        )
+        parser.add_argument(
+            '--users',
+            type=str,
+            help='User counts, as START:STOP:STEP or a comma-separated list (e.g. 50:5000:50)',
+        )
+        parser.add_argument(
+            '--laptop-share',
+            type=str,
+            help='Shares of office PCs that are laptops, as START:STOP:STEP or a list (e.g. 0,0.5,1)',
+        )
+        parser.add_argument(
+            '--internet',
+            type=str,
+            help='Internet lines as a comma-separated list of TYPE:SPEED (e.g. FO:100MBps,STARLINK:500MBps)',
+        )
+        parser.add_argument(
+            '--by-category',
+            action='store_true',
+            help='Include per-category totals',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the results to this .json or .csv file instead of printing them',
+        )
+
+    def handle(self, *args, **options):
+        base_project = Project(**self.load_spec(options))
+
+        grid = []
+        try:
+            if options['users']:
+                grid.append(('number_of_users', self.parse_values(options['users'], int)))
+            if options['laptop_share']:
+                grid.append(('laptop_share', self.parse_values(options['laptop_share'], float)))
+            if options['internet']:
+                grid.append(('internet_line', [value.strip() for value in options['internet'].split(',')]))
+            sweep = CapacitySweep(base_project, grid)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        started = time.perf_counter()
+        results = sweep.run(by_category=options['by_category'])
+        elapsed = time.perf_counter() - started
+
+        if options['output']:
+            self.write_output(options['output'], results)
+        else:
+            for result in results:
+                point = ', '.join(
+                    f'{name}={result[name]}' for name, values in sweep.dimensions
+                )
+                self.stdout.write(
+                    f"  {point}: €{result['total_cost_france']:.2f} / MAD {result['total_cost_morocco']:.2f}"
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Evaluated {len(results)} grid points in {elapsed:.2f}s')
+        )
+
+    def load_spec(self, options):
+        """Read and validate the base project spec"""
+        spec = {}
+        try:
+            if options['spec']:
+                spec = json.loads(options['spec'])
+            elif options['file']:
+                with open(options['file'], 'r', encoding='utf-8') as f:
+                    spec = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Invalid base spec: {e}')
+
+        serializer = ProjectCreateSerializer(data=spec, partial=True)
+        if not serializer.is_valid():
+            raise CommandError(f'Invalid base spec: {serializer.errors}')
+        return serializer.validated_data
+
+    def parse_values(self, value, cast):
+        """Parse START:STOP:STEP or a comma-separated list"""
+        try:
+            if ':' in value:
+                start, stop, step = (cast(part) for part in value.split(':'))
+                return CapacitySweep.expand_range(start, stop, step)
+            return [cast(part) for part in value.split(',') if part.strip()]
+        except (TypeError, ValueError) as e:
+            raise CommandError(f'Invalid values "{value}": {e}')
+
+    def write_output(self, path, results):
+        """Write results as JSON or, for a .csv path, one row per grid point"""
+        if path.endswith('.csv'):
+            fieldnames = [key for key in results[0] if key != 'categories'] if results else []
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(results)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        self.stdout.write(f'Results written to {path}')
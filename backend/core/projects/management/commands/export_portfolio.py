@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.models import Project
+from projects.portfolio import PORTFOLIO_CONTENT_TYPES, worker_count, write_portfolio
+
+
+class Command(BaseCommand):
+    help = 'Export the budgets of many projects to one workbook or ZIP, built in parallel worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str, help='Path of the file to write')
+        parser.add_argument(
+            '--format',
+            choices=list(PORTFOLIO_CONTENT_TYPES),
+            default='xlsx',
+            help='"xlsx": a summary sheet and one sheet per project, "zip": one workbook per project (default: xlsx)',
+        )
+        parser.add_argument('--ids', type=int, nargs='+', help='Only these project ids')
+        parser.add_argument('--entity', type=str, nargs='+', help='Only projects of these entities')
+        parser.add_argument('--status', type=str, nargs='+', help='Only projects with these statuses')
+        parser.add_argument('--priority', type=str, nargs='+', help='Only projects with these priorities')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of worker processes (default: PORTFOLIO_EXPORT_WORKERS; 1 runs in-process)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Number of projects per worker task (default: PORTFOLIO_EXPORT_CHUNK_SIZE)',
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        chunk_size = options['chunk_size']
+        if any(value is not None and value < 1 for value in (workers, chunk_size)):
+            raise CommandError('--workers and --chunk-size must be positive')
+        workers = workers or worker_count()
+
+        projects = Project.objects.all()
+        if options['ids']:
+            projects = projects.filter(pk__in=options['ids'])
+        for field in ['entity', 'status', 'priority']:
+            if options[field]:
+                projects = projects.filter(**{f'{field}__in': options[field]})
+        projects = list(projects.defer('budget_breakdown').order_by('name', 'pk'))
+        if not projects:
+            raise CommandError('No projects match the filter')
+
+        self.stdout.write(f'Exporting {len(projects)} projects with {workers} worker(s)...')
+        started = time.perf_counter()
+        write_portfolio(projects, options['output'], options['format'], workers, chunk_size)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['output']} in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.export_jobs import process_jobs, run_worker, worker_lock
+
+
+class Command(BaseCommand):
+    help = 'Run queued budget export jobs; exits when the queue is empty unless --poll is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll',
+            type=float,
+            help='Keep running, checking for new jobs every POLL seconds',
+        )
+
+    def handle(self, *args, **options):
+        poll = options['poll']
+        if poll is not None and poll <= 0:
+            raise CommandError('--poll must be positive')
+
+        if poll is None:
+            count = run_worker()
+            if count:
+                self.stdout.write(f'Processed {count} export job(s)')
+            return
+
+        # Keep the worker lock while polling, so submits do not start more workers
+        while True:
+            with worker_lock() as acquired:
+                while acquired:
+                    count = process_jobs()
+                    if count:
+                        self.stdout.write(f'Processed {count} export job(s)')
+                    time.sleep(poll)
+            # Another worker holds the lock: wait for it to exit
+            time.sleep(poll)
@@ -1,49 +1,243 @@
-from django.core.management.base import BaseCommand
+import json
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, time as dt_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
 from projects.models import Project
 from calculations.services import ProjectCalculator
 
 
+def recalculate_chunk(project_ids, force=False):
+    """
+    Recalculate and save the budgets of one chunk of projects.
+
+    Runs in a worker process; the smart rules of the whole chunk are evaluated
+    in one vectorized pass. Projects whose stored budget is still current are
+    skipped unless force is set. Returns one result dict per project; its
+    'seconds' include an equal share of the chunk's vectorized pass.
+    """
+    calculator = ProjectCalculator()
+    projects = list(Project.objects.filter(pk__in=project_ids).order_by('pk'))
+    planning_started = time.perf_counter()
+    try:
+        plans = calculator.get_plans(projects)
+    except Exception:
+        # One bad project fails the whole vectorized pass: plan each project on its own,
+        # so that only that project is reported as an error
+        plans = [None] * len(projects)
+    # Each project is charged an equal share of the chunk's vectorized pass
+    planning_share = (time.perf_counter() - planning_started) / len(projects) if projects else 0
+
+    results = []
+    for project, plan in zip(projects, plans):
+        started = time.perf_counter() - planning_share
+        try:
+            project_items, total_france, total_morocco = calculator.save_project_budget(
+                project, plan=plan, force=force
+            )
+            results.append({
+                'project_id': project.pk,
+                'project_name': project.name,
+                'status': 'success',
+                'total_france': str(total_france),
+                'total_morocco': str(total_morocco),
+                'items_count': len(project_items),
+                'cached': calculator.last_cache_hit,
+                'seconds': time.perf_counter() - started,
+            })
+        except Exception as e:
+            results.append({
+                'project_id': project.pk,
+                'project_name': project.name,
+                'status': 'error',
+                'error': str(e),
+                'seconds': time.perf_counter() - started,
+            })
+    return results
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
 class Command(BaseCommand):
-    help = 'Recalculate budgets for all projects'
+    help = 'Recalculate budgets for all projects, in parallel chunks with resumable checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes (default: 1, runs in-process)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Number of projects per chunk (default: 200)',
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Only recalculate projects updated at or after this date/datetime (ISO format)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            default=os.path.join(tempfile.gettempdir(), 'recalculate_budgets.checkpoint.json'),
+            help='Checkpoint file used to resume an interrupted run (default: in the temporary directory)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recalculate even the projects whose stored budget is up to date',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and start from scratch',
+        )
 
     def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        workers = options['workers']
+        chunk_size = options['chunk_size']
+        force = options['force']
+        if workers < 1 or chunk_size < 1:
+            raise CommandError('--workers and --chunk-size must be positive')
+
+        since = self.parse_since(options['since'])
+        checkpoint_path = options['checkpoint']
+
         self.stdout.write('Starting budget recalculation for all projects...')
-        
-        calculator = ProjectCalculator()
+
         projects = Project.objects.all()
-        
-        if not projects.exists():
+        if since:
+            projects = projects.filter(updated_at__gte=since)
+        project_ids = list(projects.order_by('pk').values_list('pk', flat=True))
+
+        if not project_ids:
             self.stdout.write(self.style.WARNING('No projects found in database'))
             return
-        
-        self.stdout.write(f'Found {projects.count()} projects to process')
-        
-        success_count = 0
-        error_count = 0
-        
-        for project in projects:
-            try:
-                self.stdout.write(f'Processing project: {project.name} (ID: {project.id})')
-                
-                # Recalculate budget
-                project_items, total_france, total_morocco = calculator.save_project_budget(project)
-                
+
+        # Resume: skip the id ranges already completed by a previous run with the same filter
+        checkpoint = self.load_checkpoint(checkpoint_path, options['since'], options['restart'])
+        done_ranges = checkpoint['completed']
+        pending_ids = [
+            pk for pk in project_ids
+            if not any(first <= pk <= last for first, last in done_ranges)
+        ]
+        if len(pending_ids) < len(project_ids):
+            self.stdout.write(
+                f'Resuming from checkpoint: {len(project_ids) - len(pending_ids)} projects already done'
+            )
+
+        chunks = [pending_ids[i:i + chunk_size] for i in range(0, len(pending_ids), chunk_size)]
+        self.stdout.write(
+            f'Found {len(pending_ids)} projects to process in {len(chunks)} chunks with {workers} worker(s)'
+        )
+
+        results = []
+        started = time.perf_counter()
+
+        if workers == 1:
+            for chunk in chunks:
+                self.chunk_done(chunk, recalculate_chunk(chunk, force), results, checkpoint, checkpoint_path)
+        else:
+            # Worker processes must open their own database connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(recalculate_chunk, chunk, force): chunk for chunk in chunks}
+                for future in as_completed(futures):
+                    self.chunk_done(futures[future], future.result(), results, checkpoint, checkpoint_path)
+
+        elapsed = time.perf_counter() - started
+
+        # The run is complete, the checkpoint is no longer needed
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        self.write_summary(results, elapsed)
+
+    def chunk_done(self, chunk, chunk_results, results, checkpoint, checkpoint_path):
+        """Record a finished chunk, report errors and persist the checkpoint"""
+        results.extend(chunk_results)
+
+        for result in chunk_results:
+            if result['status'] == 'error':
                 self.stdout.write(
-                    f'  ✓ Budget calculated: €{total_france} / MAD {total_morocco} '
-                    f'({len(project_items)} items)'
+                    self.style.ERROR(
+                        f"  ✗ Error processing project {result['project_name']}: {result['error']}"
+                    )
                 )
-                success_count += 1
-                
-            except Exception as e:
+            elif self.verbosity >= 2:
                 self.stdout.write(
-                    self.style.ERROR(f'  ✗ Error processing project {project.name}: {str(e)}')
+                    f"  ✓ {result['project_name']} (ID: {result['project_id']}): "
+                    f"€{result['total_france']} / MAD {result['total_morocco']} ({result['items_count']} items)"
                 )
-                error_count += 1
-        
+
+        checkpoint['completed'].append([chunk[0], chunk[-1]])
+        with open(checkpoint_path, 'w') as f:
+            json.dump(checkpoint, f)
+
+        self.stdout.write(f'Processed {len(results)} projects...')
+
+    def load_checkpoint(self, path, since, restart):
+        """Load the checkpoint of a previous run with the same --since filter, if any"""
+        empty = {'since': since, 'completed': []}
+        if restart or not os.path.exists(path):
+            return empty
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return empty
+        if checkpoint.get('since') != since:
+            return empty
+        return checkpoint
+
+    def parse_since(self, value):
+        """Parse --since as an aware datetime"""
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError(f'Invalid --since value: {value}')
+            parsed = datetime.combine(date, dt_time.min)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def write_summary(self, results, elapsed):
+        success_count = len([r for r in results if r['status'] == 'success'])
+        error_count = len([r for r in results if r['status'] == 'error'])
+        cached_count = len([r for r in results if r.get('cached')])
+        durations = sorted(r['seconds'] for r in results)
+        throughput = len(results) / elapsed if elapsed > 0 else 0
+
         self.stdout.write('')
+        self.stdout.write(
+            f'Throughput: {throughput:.1f} projects/s over {elapsed:.2f}s '
+            f'(per project p50: {_percentile(durations, 50) * 1000:.1f} ms, '
+            f'p95: {_percentile(durations, 95) * 1000:.1f} ms)'
+        )
         self.stdout.write(
             self.style.SUCCESS(
                 f'Budget recalculation completed! '
-                f'Success: {success_count}, Errors: {error_count}'
+                f'Success: {success_count} ({cached_count} unchanged, skipped), Errors: {error_count}'
             )
         )
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0015_remove_legacy_equipment_models'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='budget_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='budget_catalog_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0016_project_budget_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='budget_breakdown',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
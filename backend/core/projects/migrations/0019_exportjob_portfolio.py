@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0018_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='kind',
+            field=models.CharField(choices=[('project', 'Project budget'), ('portfolio', 'Portfolio')], default='project', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='params',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='project',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='projects.project'),
+        ),
+    ]
@@ -101,6 +101,11 @@ class Project(models.Model):
     # Budget fields - calculated and stored in database
     total_cost_france = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Total cost in EUR")
     total_cost_morocco = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Total cost in MAD")
+    # Fingerprint of the cost-driving fields and catalog version the stored budget was calculated from
+    budget_fingerprint = models.CharField(max_length=64, blank=True, default="", editable=False)
+    budget_catalog_version = models.PositiveBigIntegerField(default=0, editable=False)
+    # Per-category breakdown of the stored budget (see ProjectCalculator.get_budget_breakdown); null until built
+    budget_breakdown = models.JSONField(null=True, blank=True, editable=False)
 
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="projects")
     created_at = models.DateTimeField(default=timezone.now)
@@ -185,13 +190,7 @@ class Project(models.Model):
         # Factor 4: Equipment complexity (more equipment = higher priority)
         # Only calculate if project has been saved (has primary key)
         if self.pk:
-            total_equipment = (
-                self.projectnetworkitem_set.count() +
-                self.projectserveritem_set.count() +
-                self.projectuserdeviceitem_set.count() +
-                self.projectsoftwareitem_set.count() +
-                self.projectserviceitem_set.count()
-            )
+            total_equipment = self.items.count()
             if total_equipment > 20:
                 priority_score += 2
             elif total_equipment > 10:
@@ -248,4 +247,49 @@ class Project(models.Model):
     def __str__(self):
         return f"{self.name} - {self.company_name or 'N/A'}"
 
-# Legacy project item models removed - using calculations.models.ProjectItem instead
\ No newline at end of file
+# Legacy project item models removed - using calculations.models.ProjectItem instead
+
+class ExportJob(models.Model):
+    """Budget workbook or portfolio export run by a background worker (see projects.export_jobs)"""
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    class Kind(models.TextChoices):
+        PROJECT = "project", "Project budget"
+        PORTFOLIO = "portfolio", "Portfolio"
+
+    kind = models.CharField(max_length=10, choices=Kind.choices, default=Kind.PROJECT)
+    # None for portfolio exports
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True, blank=True, related_name="export_jobs")
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="export_jobs")
+    # Portfolio exports: {"project_ids": [...], "format": "xlsx" | "zip"}
+    params = models.JSONField(default=dict, blank=True)
+    # export_cache_key() (or portfolio_cache_key()) of the requested file: identical requests share one job
+    cache_key = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Progress percentage (0-100)")
+    file_path = models.CharField(max_length=500, blank=True, default="")
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Bumped by the worker while running; a stale heartbeat means the worker died
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["project", "cache_key"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="unique_active_project_export_job",
+            ),
+        ]
+
+    def __str__(self):
+        if self.kind == self.Kind.PORTFOLIO:
+            return f"Portfolio export {self.pk} ({self.status})"
+        return f"Export {self.pk} of {self.project_id} ({self.status})"
@@ -0,0 +1,248 @@
+"""
+Portfolio exports: the budgets of many projects in one file.
+
+Per-project work is split into chunks run in worker processes
+(ProcessPoolExecutor, as in recalculate_budgets) by the export_portfolio
+command and by the export job worker (projects.export_jobs). The web view
+only builds small portfolios itself, in-process: larger ones are queued as
+export jobs, as a request must neither wait for them nor fork a pool. Each
+worker keeps one exporter, so the export catalog is loaded once per process
+and shared by all of its chunks, and the budget plans of a chunk are built in
+one vectorized pass. The parent process assembles the results in project order as they come
+in: sheet rows are streamed into a write-only workbook (a summary sheet plus
+one sheet per project), or the cached per-project workbooks are added to a ZIP.
+
+Settings:
+    PORTFOLIO_EXPORT_WORKERS       worker processes of the command and export jobs (default: CPU count, at most 8;
+                                   1 runs in-process)
+    PORTFOLIO_EXPORT_INLINE_MAX    largest portfolio built within the request; larger ones are queued (default: 20)
+    PORTFOLIO_EXPORT_CHUNK_SIZE    projects per worker task (default: 20)
+    PORTFOLIO_EXPORT_MAX_PROJECTS  largest accepted portfolio (default: 500)
+"""
+import hashlib
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connections
+from django.utils.text import slugify
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+
+from materials.models import CatalogVersion
+
+from .export_cache import export_cache_key, get_or_create_export
+from .exporters import ExcelExporter
+from .models import Project
+
+PORTFOLIO_CONTENT_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'zip': 'application/zip',
+}
+
+SUMMARY_TITLE = 'Summary'
+
+# Summary columns: (header, width, cell of the project sheet holding the value)
+SUMMARY_COLUMNS = [
+    ('Project', 40, None),
+    ('Entity', 12, None),
+    ('Status', 14, None),
+    ('NB of users', 12, None),
+    ('One off €', 14, 'F4'),
+    ('Monthly €', 14, 'F5'),
+    ('Yearly €', 14, 'F6'),
+    ('Monthly total €', 16, 'F7'),
+    ('Yearly total €', 16, 'F8'),
+]
+
+# Characters Excel does not accept in sheet titles
+INVALID_TITLE_CHARACTERS = re.compile(r'[\\/?*\[\]:]')
+
+# Exporter of the current worker process, kept across its chunks
+_exporter = None
+
+
+def worker_count():
+    return getattr(settings, 'PORTFOLIO_EXPORT_WORKERS', min(8, os.cpu_count() or 1))
+
+
+def inline_max_projects():
+    return getattr(settings, 'PORTFOLIO_EXPORT_INLINE_MAX', 20)
+
+
+def portfolio_cache_key(projects, file_format):
+    """Hash of the format and of the workbook keys of projects, in order"""
+    catalog_version = CatalogVersion.current()
+    payload = json.dumps([file_format] + [export_cache_key(project, catalog_version) for project in projects])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _process_exporter():
+    global _exporter
+    if _exporter is None:
+        _exporter = ExcelExporter(write_only=True)
+    return _exporter
+
+
+def _chunk_projects(project_ids):
+    """Projects of a chunk, in the order of project_ids"""
+    projects = Project.objects.in_bulk(project_ids)
+    return [projects[pk] for pk in project_ids if pk in projects]
+
+
+def sheet_rows_chunk(project_ids, has_logo, exporter=None):
+    """Budget sheet rows of a chunk of projects, as [(project id, rows)]"""
+    exporter = exporter or _process_exporter()
+    projects = _chunk_projects(project_ids)
+    snapshots = exporter.get_snapshots(projects)
+    return [
+        (project.pk, exporter.sheet_rows(project, snapshot, has_logo))
+        for project, snapshot in zip(projects, snapshots)
+    ]
+
+
+def export_files_chunk(project_ids, exporter=None):
+    """Cached budget workbooks of a chunk of projects, as [(project id, path)]"""
+    exporter = exporter or _process_exporter()
+    return [
+        (project.pk, get_or_create_export(project, exporter)[1])
+        for project in _chunk_projects(project_ids)
+    ]
+
+
+def run_chunks(function, project_ids, workers=None, chunk_size=None):
+    """
+    Results of function over chunks of project_ids, yielded in chunk order as
+    soon as they are available. Runs in-process with one worker or one chunk.
+    """
+    workers = workers or worker_count()
+    chunk_size = chunk_size or getattr(settings, 'PORTFOLIO_EXPORT_CHUNK_SIZE', 20)
+    chunks = [project_ids[i:i + chunk_size] for i in range(0, len(project_ids), chunk_size)]
+
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield function(chunk)
+        return
+
+    # Worker processes must open their own database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        yield from executor.map(function, chunks)
+
+
+def sheet_title(name, used):
+    """Valid, unique worksheet title for a project name (Excel: 31 characters at most)"""
+    base = ' '.join(INVALID_TITLE_CHARACTERS.sub(' ', name).split()).strip("'")[:31] or 'Project'
+    title = base
+    number = 2
+    while title.lower() in used:
+        suffix = f' ({number})'
+        title = base[:31 - len(suffix)] + suffix
+        number += 1
+    used.add(title.lower())
+    return title
+
+
+def write_portfolio(projects, output, file_format='xlsx', workers=None, chunk_size=None, progress=None):
+    """
+    Write the portfolio file of projects (in order) to output, a path or a binary
+    file object. progress, if given, is called with the fraction of projects done.
+    """
+    if file_format == 'zip':
+        write_portfolio_zip(projects, output, workers, chunk_size, progress)
+    else:
+        write_portfolio_workbook(projects, output, workers, chunk_size, progress)
+    return output
+
+
+def write_portfolio_workbook(projects, output, workers=None, chunk_size=None, progress=None):
+    """One workbook: a summary sheet, then the budget sheet of every project"""
+    exporter = ExcelExporter(write_only=True)
+    has_logo = exporter._load_logo() is not None
+
+    used = {SUMMARY_TITLE.lower()}
+    titles = {project.pk: sheet_title(project.name, used) for project in projects}
+
+    wb = Workbook(write_only=True)
+    for style in exporter.named_styles():
+        wb.add_named_style(style)
+    write_summary(wb.create_sheet(SUMMARY_TITLE), projects, titles)
+
+    workers = workers or worker_count()
+    # In-process, the chunks share this exporter; workers use their own
+    function = partial(sheet_rows_chunk, has_logo=has_logo, exporter=exporter if workers == 1 else None)
+    done = 0
+    for results in run_chunks(function, [project.pk for project in projects], workers, chunk_size):
+        for project_id, rows in results:
+            ws = wb.create_sheet(titles[project_id])
+            exporter._write_streaming(ws, rows, exporter._load_logo() if has_logo else None)
+        done += len(results)
+        if progress:
+            progress(done / len(projects))
+
+    wb.save(output)
+
+
+def write_summary(ws, projects, titles):
+    """Summary sheet: one row per project, with its totals read from its sheet"""
+    for index, (header, width, _) in enumerate(SUMMARY_COLUMNS):
+        ws.column_dimensions[get_column_letter(index + 1)].width = width
+
+    def styled(value, style):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = style
+        return cell
+
+    ws.append([styled(f'Portfolio budget: {len(projects)} projects', 'bycn_title')])
+    ws.merged_cells.add(f'A1:{get_column_letter(len(SUMMARY_COLUMNS))}1')
+    ws.append([])
+    ws.append([styled(header, 'bycn_header') for header, _, _ in SUMMARY_COLUMNS])
+
+    first_row = 4
+    for project in projects:
+        sheet = "'{}'".format(titles[project.pk].replace("'", "''"))
+        row = [
+            styled(project.name, 'bycn_cell'),
+            styled(project.entity or '', 'bycn_cell'),
+            styled(project.get_status_display(), 'bycn_cell'),
+            styled(project.number_of_users, 'bycn_cell'),
+        ]
+        row += [styled(f'={sheet}!{cell}', 'bycn_currency') for _, _, cell in SUMMARY_COLUMNS[4:]]
+        ws.append(row)
+
+    last_row = first_row + len(projects) - 1
+    totals = [styled('TOTAL:', 'bycn_total_label')] + [styled(None, 'bycn_total_label') for _ in range(3)]
+    for index in range(4, len(SUMMARY_COLUMNS)):
+        column = get_column_letter(index + 1)
+        totals.append(styled(f'=SUM({column}{first_row}:{column}{last_row})', 'bycn_total_value'))
+    ws.append(totals)
+    ws.merged_cells.add(f'A{last_row + 1}:D{last_row + 1}')
+
+
+def write_portfolio_zip(projects, output, workers=None, chunk_size=None, progress=None):
+    """A ZIP of the budget workbook of every project, built through the export cache"""
+    workers = workers or worker_count()
+    exporter = ExcelExporter(write_only=True)
+    names = {project.pk: f'budget_{slugify(project.name)}_{project.pk}.xlsx' for project in projects}
+    by_id = {project.pk: project for project in projects}
+
+    function = partial(export_files_chunk, exporter=exporter if workers == 1 else None)
+    # The workbooks are already compressed: store them as they are
+    done = 0
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        for results in run_chunks(function, list(by_id), workers, chunk_size):
+            for project_id, path in results:
+                try:
+                    archive.write(path, names[project_id])
+                except FileNotFoundError:
+                    # Evicted from the export cache meanwhile: rebuild it here
+                    _, path, _ = get_or_create_export(by_id[project_id], exporter)
+                    archive.write(path, names[project_id])
+            done += len(results)
+            if progress:
+                progress(done / len(projects))
@@ -19,6 +19,8 @@ class ProjectListSerializer(serializers.ModelSerializer):
     
     def get_total_items(self, obj):
         """Get total number of items in this project"""
+        if hasattr(obj, 'items_count'):
+            return obj.items_count
         return ProjectItem.objects.filter(project=obj).count()
 
 
@@ -43,12 +45,14 @@ class ProjectDetailSerializer(serializers.ModelSerializer):
     
     def get_total_items(self, obj):
         """Get total number of items in this project"""
+        if hasattr(obj, 'items_count'):
+            return obj.items_count
         return ProjectItem.objects.filter(project=obj).count()
     
     def get_budget_breakdown(self, obj):
         """Get budget breakdown by category"""
         from calculations.services import ProjectCalculator
-        calculator = ProjectCalculator()
+        calculator = self.context.get('calculator') or ProjectCalculator()
         return calculator.get_budget_breakdown(obj)
 
 
@@ -94,11 +98,13 @@ class ProjectUpdateSerializer(serializers.ModelSerializer):
     
     def update(self, instance, validated_data):
         """Update project and recalculate budget"""
+        from calculations.services import ProjectCalculator, project_state_key
+        previous_state_key = project_state_key(instance)
+        
         project = super().update(instance, validated_data)
         
-        # Recalculate budget after update
-        from calculations.services import ProjectCalculator
+        # Recalculate only the budget lines affected by the changed fields
         calculator = ProjectCalculator()
-        calculator.save_project_budget(project)
+        calculator.update_project_budget(project, previous_state_key)
         
         return project
\ No newline at end of file
@@ -0,0 +1,106 @@
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from calculations.models import ProjectItem
+from materials.models import Category, Material
+from projects.models import Project
+
+
+class ProjectListQueryTests(TestCase):
+    """The project list is served in a constant number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='secret')
+        category = Category.objects.create(name='Hardware')
+        materials = [
+            Material.objects.create(
+                name=f'Material {index}', category=category,
+                price_france=Decimal('10.00'), price_morocco=Decimal('108.00'),
+            )
+            for index in range(3)
+        ]
+        for index in range(12):
+            project = Project.objects.create(name=f'Project {index}', number_of_users=10, created_by=cls.user)
+            for material in materials[:index % 4]:
+                ProjectItem.objects.create(project=project, material=material, quantity=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def list_projects(self, page_size):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/projects/projects/', {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        return response, len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        _, small_page_queries = self.list_projects(2)
+        _, full_page_queries = self.list_projects(12)
+        self.assertEqual(small_page_queries, full_page_queries)
+
+    def test_page_is_one_count_and_one_select(self):
+        with self.assertNumQueries(2):
+            self.client.get('/api/projects/projects/', {'page_size': 12})
+
+    def test_total_items_is_annotated(self):
+        response, _ = self.list_projects(12)
+        totals = {row['name']: row['total_items'] for row in response.data['results']}
+        self.assertEqual(totals['Project 0'], 0)
+        self.assertEqual(totals['Project 3'], 3)
+        self.assertEqual(totals['Project 5'], 1)
+
+
+class BudgetBreakdownNamesTests(TestCase):
+    """The stored budget breakdown follows category and material renames"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='secret')
+        cls.hardware = Category.objects.create(name='Hardware')
+        cls.network = Category.objects.create(name='Network')
+        cls.laptop = Material.objects.create(
+            name='Laptop', category=cls.hardware, price_france=Decimal('10.00'), price_morocco=Decimal('108.00'),
+        )
+        cls.project = Project.objects.create(name='Project', number_of_users=10, created_by=cls.user)
+        ProjectItem.objects.create(project=cls.project, material=cls.laptop, quantity=2)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def breakdown(self):
+        response = self.client.get(f'/api/projects/projects/{self.project.pk}/budget/')
+        self.assertEqual(response.status_code, 200)
+        return {
+            category: [item['material_name'] for item in data['items']]
+            for category, data in response.data['budget_breakdown'].items()
+        }
+
+    def test_renames_and_moves_are_reflected(self):
+        self.assertEqual(self.breakdown(), {'Hardware': ['Laptop']})
+
+        self.hardware.name = 'Renamed'
+        self.hardware.save()
+        self.laptop.name = 'Laptop2'
+        self.laptop.save()
+        self.assertEqual(self.breakdown(), {'Renamed': ['Laptop2']})
+
+        self.laptop.category = self.network
+        self.laptop.save()
+        self.assertEqual(self.breakdown(), {'Network': ['Laptop2']})
+
+    def test_unrelated_saves_keep_the_stored_breakdown(self):
+        self.breakdown()
+        self.laptop.description = 'A laptop'
+        self.laptop.save()
+        self.network.name = 'Networking'
+        self.network.save()
+        self.project.refresh_from_db()
+        self.assertIsNotNone(self.project.budget_breakdown)
@@ -4,16 +4,27 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.pagination import PageNumberPagination
 from django.shortcuts import get_object_or_404
+from django.db.models import Count, Q
 # ProjectItemGenerator removed - using Material model instead
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.cache import cache
 from .exporters import ExcelExporter
+from .export_cache import export_cache_key, get_or_create_export
+from .export_jobs import job_data, submit_export_job, submit_portfolio_job
+from .portfolio import PORTFOLIO_CONTENT_TYPES, inline_max_projects, write_portfolio
+from accounts.permissions import IsAdminOrSuperAdmin
 from django.conf import settings
 from django.utils.text import slugify
 from django.utils import timezone
+import json
 import os
 import posixpath
+import shutil
+import tempfile
+from contextlib import nullcontext
 
-from .models import Project
+from .models import ExportJob, Project
 from .serializers import (
     ProjectListSerializer,
     ProjectDetailSerializer,
@@ -22,6 +33,14 @@ from .serializers import (
 )
 
 
+# Seconds a budget preview stays cached for the same spec and catalog version
+PREVIEW_CACHE_TIMEOUT = 600
+
+# Maximum number of specs accepted by quote-batch, and specs priced per vectorized pass
+QUOTE_BATCH_MAX_SIZE = 1000
+QUOTE_BATCH_CHUNK_SIZE = 100
+
+
 class StandardPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
@@ -53,19 +72,17 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        print(f"DEBUG: User: {user.username}")
-        print(f"DEBUG: User role: {getattr(user, 'role', None)}")
-        print(f"DEBUG: Is staff: {user.is_staff}")
-        print(f"DEBUG: Is superuser: {user.is_superuser}")
+        projects = Project.objects.select_related('created_by')
+        if self.action in ['list', 'retrieve']:
+            # Item counts in the same query instead of one count() per row
+            projects = projects.annotate(items_count=Count('items'))
+        if self.action == 'list':
+            projects = projects.defer('budget_breakdown')
         
         # allow admins to see all projects
         if getattr(user, 'role', None) in ['admin', 'super_admin'] or user.is_staff or user.is_superuser:
-            projects = Project.objects.select_related('created_by').all()
-            print(f"DEBUG: Returning all projects: {projects.count()}")
-            return projects
-        projects = Project.objects.select_related('created_by').filter(created_by=user)
-        print(f"DEBUG: Returning user projects: {projects.count()}")
-        return projects
+            return projects.all()
+        return projects.filter(created_by=user)
     
     def get_object(self):
         """
@@ -87,41 +104,176 @@ class ProjectViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'], url_path='export-excel')
     def export_excel(self, request, pk=None):
+        project = self.get_object()
+        key = export_cache_key(project)
+
+        # The cache key identifies the file content: let clients revalidate cheaply
+        etag = f'"{key}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
         try:
-            project = self.get_object()
-            exporter = ExcelExporter()
-            excel_buffer = exporter.generate_project_excel(project)
+            # Write-only mode: rows are streamed to the file, never held as a second in-memory copy
+            key, file_path, cache_hit = get_or_create_export(project, ExcelExporter(write_only=True), key)
+            # Once open, the file stays readable even if it is evicted meanwhile
+            excel_file = open(file_path, 'rb')
         except Exception as e:
             return Response(
                 {'error': f'Failed to generate Excel export: {str(e)}'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-        # If save=1, save to MEDIA_ROOT/exports/projects and return JSON
+        # If save=1, copy the file to MEDIA_ROOT/exports/projects (cache entries can be evicted) and return JSON
         save_flag = request.query_params.get("save", "0").lower() in ("1", "true", "yes")
         if save_flag:
             filename = f"budget_{slugify(project.name)}_{project.pk}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
             export_dir = os.path.join(settings.MEDIA_ROOT, "exports", "projects")
             os.makedirs(export_dir, exist_ok=True)
             file_path = os.path.join(export_dir, filename)
-            with open(file_path, "wb") as f:
-                f.write(excel_buffer.getvalue())
+            with excel_file, open(file_path, "wb") as f:
+                shutil.copyfileobj(excel_file, f)
 
             file_url = None
             if getattr(settings, "MEDIA_URL", None):
                 file_url = request.build_absolute_uri(
                     posixpath.join(settings.MEDIA_URL.rstrip("/"), "exports/projects", filename)
                 )
-            return Response({"saved": True, "path": file_path, "url": file_url})
+            return Response({"saved": True, "path": file_path, "url": file_url, "cached": cache_hit})
 
-        # Default behavior: download the file
-        response = HttpResponse(
-            excel_buffer.getvalue(),
+        # Default behavior: download the file, streamed from disk
+        response = FileResponse(
+            excel_file,
+            as_attachment=True,
+            filename=f"budget_{slugify(project.name)}_{project.pk}.xlsx",
             content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
-        response["Content-Disposition"] = f'attachment; filename="budget_{slugify(project.name)}_{project.pk}.xlsx"'
+        response['ETag'] = etag
+        response['X-Export-Cache'] = 'hit' if cache_hit else 'miss'
         return response
 
+    @action(detail=True, methods=['post'], url_path='export-jobs')
+    def create_export_job(self, request, pk=None):
+        """Queue a background export of the budget workbook (identical pending requests share one job)"""
+        project = self.get_object()
+        job, created = submit_export_job(project, request.user)
+        data = job_data(job, request)
+        data['deduplicated'] = not created
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    def get_export_job(self, job_id):
+        """Export job of a project visible to the current user, or portfolio export job of the user"""
+        jobs = ExportJob.objects.filter(
+            Q(project__in=self.get_queryset()) |
+            Q(kind=ExportJob.Kind.PORTFOLIO, requested_by=self.request.user)
+        )
+        return get_object_or_404(jobs, pk=job_id)
+
+    @action(detail=False, methods=['get'], url_path=r'export-jobs/(?P<job_id>[0-9]+)')
+    def export_job(self, request, job_id=None):
+        """Status and progress of an export job, with a download link once done"""
+        return Response(job_data(self.get_export_job(job_id), request))
+
+    @action(detail=False, methods=['get'], url_path=r'export-jobs/(?P<job_id>[0-9]+)/download')
+    def export_job_download(self, request, job_id=None):
+        job = self.get_export_job(job_id)
+        if job.status != ExportJob.Status.DONE:
+            return Response(
+                {'error': f'Export is {job.status}', 'job': job_data(job, request)},
+                status=status.HTTP_409_CONFLICT
+            )
+        try:
+            export_file = open(job.file_path, 'rb')
+        except FileNotFoundError:
+            # Evicted from the export cache since: the client has to submit a new job
+            return Response(
+                {'error': 'Export file expired, please request a new export'},
+                status=status.HTTP_410_GONE
+            )
+        if job.kind == ExportJob.Kind.PORTFOLIO:
+            file_format = job.params['format']
+            return FileResponse(
+                export_file,
+                as_attachment=True,
+                filename=f"portfolio_{job.created_at:%Y%m%d_%H%M}.{file_format}",
+                content_type=PORTFOLIO_CONTENT_TYPES[file_format],
+            )
+        return FileResponse(
+            export_file,
+            as_attachment=True,
+            filename=f"budget_{slugify(job.project.name)}_{job.project_id}.xlsx",
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+
+    @action(detail=False, methods=['post'], url_path='export-portfolio')
+    def export_portfolio(self, request):
+        """
+        Budgets of many projects in one file.
+
+        Accepts {"ids": [...], "entity": ..., "status": ..., "priority": ..., "format": "xlsx" | "zip"};
+        every filter is optional and entity/status/priority also take a list. "xlsx" gives
+        one workbook with a summary sheet and one sheet per project, "zip" one workbook per project.
+
+        Up to PORTFOLIO_EXPORT_INLINE_MAX projects, the file is the response. Larger portfolios
+        are queued as an export job built with a process pool: the response is then 202 with the
+        job, to poll at export-jobs/<id>/ like budget export jobs.
+        """
+        data = request.data if isinstance(request.data, dict) else {}
+        file_format = data.get('format', 'xlsx')
+        if file_format not in PORTFOLIO_CONTENT_TYPES:
+            return Response(
+                {'error': f"Unknown format '{file_format}' (expected: {', '.join(PORTFOLIO_CONTENT_TYPES)})"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        projects = self.get_queryset()
+        ids = data.get('ids')
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+                return Response({'error': '"ids" must be a list of project ids'}, status=status.HTTP_400_BAD_REQUEST)
+            projects = projects.filter(pk__in=ids)
+        for field in ['entity', 'status', 'priority']:
+            value = data.get(field)
+            if isinstance(value, list):
+                projects = projects.filter(**{f'{field}__in': value})
+            elif value:
+                projects = projects.filter(**{field: value})
+
+        projects = list(projects.defer('budget_breakdown').order_by('name', 'pk'))
+        max_projects = getattr(settings, 'PORTFOLIO_EXPORT_MAX_PROJECTS', 500)
+        if not projects:
+            return Response({'error': 'No projects match the filter'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(projects) > max_projects:
+            return Response(
+                {'error': f'Portfolio too large: {len(projects)} projects (maximum {max_projects})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if len(projects) > inline_max_projects():
+            job, created = submit_portfolio_job(projects, file_format, request.user)
+            data = job_data(job, request)
+            data['deduplicated'] = not created
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+
+        # Small portfolio: assembled on disk in this process (no worker pool in a request), then streamed
+        output = tempfile.TemporaryFile()
+        try:
+            write_portfolio(projects, output, file_format, workers=1)
+        except Exception as e:
+            output.close()
+            return Response(
+                {'error': f'Failed to generate portfolio export: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=f"portfolio_{timezone.now():%Y%m%d_%H%M}.{file_format}",
+            content_type=PORTFOLIO_CONTENT_TYPES[file_format],
+        )
+
     def get_serializer_class(self):
         if self.action == 'list':
             return ProjectListSerializer
@@ -169,11 +321,38 @@ class ProjectViewSet(viewsets.ModelViewSet):
     # convenience endpoint to recalculate budget (keeps old behavior)
     @action(detail=True, methods=['post'], url_path='recalculate')
     def recalculate(self, request, pk=None):
-        project = self.get_object()
         from calculations.services import ProjectCalculator  # local import to avoid circulars
         calculator = ProjectCalculator()
-        calculator.save_project_budget(project)
-        return Response(ProjectDetailSerializer(project, context={'request': request}).data)
+        with self.start_trace(request, calculator):
+            project = self.get_object()
+            calculator.save_project_budget(project, force=True)
+            context = {'request': request, 'calculator': calculator}
+            data = ProjectDetailSerializer(project, context=context).data
+        self.finish_trace(request, calculator, data, 'recalculate', project)
+        return Response(data)
+
+    def start_trace(self, request, calculator):
+        """
+        Attach a StageTracer to the calculator for admins passing ?trace=1.
+        Returns a context manager counting the queries run inside it (a no-op without tracing).
+        """
+        if request.query_params.get('trace') not in ('1', 'true'):
+            return nullcontext()
+        if not IsAdminOrSuperAdmin().has_permission(request, self):
+            return nullcontext()
+        from calculations.tracing import StageTracer
+        calculator.tracer = StageTracer()
+        return calculator.tracer
+
+    def finish_trace(self, request, calculator, data, action, project):
+        """Add the trace to the response data and log it to the CalculationTrace table"""
+        if calculator.tracer is None:
+            return
+        from calculations.models import CalculationTrace
+        trace = calculator.tracer.as_dict()
+        calculator.tracer = None
+        CalculationTrace.record(trace, action, project=project, user=request.user)
+        data['trace'] = trace
 
     @action(detail=False, methods=['post'], url_path='recalculate-all')
     def recalculate_all(self, request):
@@ -193,7 +372,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
             
             for project in projects:
                 try:
-                    project_items, total_france, total_morocco = calculator.save_project_budget(project)
+                    project_items, total_france, total_morocco = calculator.save_project_budget(project, force=True)
                     results.append({
                         'project_id': project.id,
                         'project_name': project.name,
@@ -216,7 +395,8 @@ class ProjectViewSet(viewsets.ModelViewSet):
             
             return Response({
                 'message': f'Budget recalculation completed: {success_count} success, {error_count} errors',
-                'results': results
+                'results': results,
+                'cache_stats': ProjectCalculator.cache_stats
             })
             
         except Exception as e:
@@ -226,12 +406,158 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['get'], url_path='budget-cache-stats')
+    def budget_cache_stats(self, request):
+        """Hit/miss counters of the stored-budget cache for this worker process"""
+        from calculations.services import ProjectCalculator
+        stats = ProjectCalculator.cache_stats
+        lookups = stats['hits'] + stats['misses']
+        return Response({
+            'hits': stats['hits'],
+            'misses': stats['misses'],
+            'partial_recalculations': stats['partial'],
+            'hit_rate': stats['hits'] / lookups if lookups else 0,
+        })
+
+    @action(detail=False, methods=['post'], url_path='preview-budget')
+    def preview_budget(self, request):
+        """
+        Calculate the budget of an unsaved project spec without writing anything.
+        Results are cached under the spec fingerprint and the catalog version.
+        """
+        serializer = ProjectCreateSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        project = Project(**serializer.validated_data)
+        
+        from calculations.services import ProjectCalculator, project_fingerprint
+        from materials.models import CatalogVersion
+        cache_key = f"budget-preview:{project_fingerprint(project)}:{CatalogVersion.current()}"
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response({**data, 'cached': True})
+        
+        calculator = ProjectCalculator()
+        data = calculator.get_plan(project).as_dict()
+        cache.set(cache_key, data, PREVIEW_CACHE_TIMEOUT)
+        return Response({**data, 'cached': False})
+
+    @action(detail=False, methods=['post'], url_path='quote-batch')
+    def quote_batch(self, request):
+        """
+        Price many unsaved project specs in one call.
+        
+        Accepts {"projects": [spec, ...]} with the ProjectCreateSerializer fields and
+        returns per-spec items and EUR/MAD totals. All specs are priced against a
+        single catalog load, in chunks evaluated in one vectorized pass each. Large
+        batches are streamed so only one chunk of results is held in memory.
+        """
+        specs = request.data.get('projects') if isinstance(request.data, dict) else request.data
+        if not isinstance(specs, list) or not specs:
+            return Response({'error': 'Expected a non-empty "projects" list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(specs) > QUOTE_BATCH_MAX_SIZE:
+            return Response(
+                {'error': f'Batch too large: {len(specs)} specs (maximum {QUOTE_BATCH_MAX_SIZE})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = ProjectCreateSerializer(data=specs, many=True, partial=True)
+        serializer.is_valid(raise_exception=True)
+        projects = [Project(**data) for data in serializer.validated_data]
+        
+        from calculations.services import ProjectCalculator
+        calculator = ProjectCalculator()
+        
+        def quotes():
+            for start in range(0, len(projects), QUOTE_BATCH_CHUNK_SIZE):
+                plans = calculator.get_plans(projects[start:start + QUOTE_BATCH_CHUNK_SIZE])
+                for index, plan in enumerate(plans, start=start):
+                    yield {'index': index, 'name': plan.project.name, **plan.as_dict()}
+        
+        if len(projects) <= QUOTE_BATCH_CHUNK_SIZE:
+            results = list(quotes())
+            return Response({'count': len(results), 'results': results})
+        
+        def stream():
+            yield f'{{"count": {len(projects)}, "results": ['
+            for position, quote in enumerate(quotes()):
+                yield (',' if position else '') + json.dumps(quote, cls=DjangoJSONEncoder)
+            yield ']}'
+        
+        return StreamingHttpResponse(stream(), content_type='application/json')
+
+    @action(detail=False, methods=['post'], url_path='capacity-sweep')
+    def capacity_sweep(self, request):
+        """
+        Budget curve of a base project spec over a grid of one or two dimensions.
+        
+        Accepts {"base": spec, "dimensions": {name: values}, "by_category": bool} where
+        name is number_of_users, laptop_share or internet_line and values is a list
+        or a {"start", "stop", "step"} range. The whole grid is priced in one batched pass.
+        """
+        from calculations.services import CapacitySweep
+        
+        base = request.data.get('base') or {}
+        dimensions = request.data.get('dimensions')
+        if not isinstance(base, dict) or not isinstance(dimensions, dict) or not dimensions:
+            return Response(
+                {'error': 'Expected a "base" project spec and a non-empty "dimensions" object'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = ProjectCreateSerializer(data=base, partial=True)
+        serializer.is_valid(raise_exception=True)
+        base_project = Project(**serializer.validated_data)
+        
+        try:
+            grid = []
+            for name, values in dimensions.items():
+                if isinstance(values, dict):
+                    values = CapacitySweep.expand_range(values.get('start', 0), values.get('stop', 0), values.get('step'))
+                grid.append((name, values if isinstance(values, list) else [values]))
+            sweep = CapacitySweep(base_project, grid)
+        except (TypeError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = sweep.run(by_category=bool(request.data.get('by_category')))
+        return Response({
+            'dimensions': [name for name, values in sweep.dimensions],
+            'count': len(results),
+            'results': results,
+        })
+
+    @action(detail=True, methods=['get'], url_path='risk-simulation')
+    def risk_simulation(self, request, pk=None):
+        """
+        Monte Carlo price-risk simulation of the stored budget.
+        Query params: trials (default 10000), horizon (price changes per trial, default 1), seed.
+        """
+        project = self.get_object()
+        from calculations.simulation import BudgetRiskSimulation
+        
+        try:
+            trials = int(request.query_params.get('trials', 10000))
+            horizon = int(request.query_params.get('horizon', 1))
+            seed = request.query_params.get('seed')
+            seed = int(seed) if seed is not None else None
+        except ValueError:
+            return Response(
+                {'error': 'trials, horizon and seed must be integers'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            simulation = BudgetRiskSimulation(project, trials=trials, horizon=horizon, seed=seed)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(simulation.run())
+
     @action(detail=True, methods=['get'], url_path='budget')
     def budget(self, request, pk=None):
-        project = self.get_object()
         from calculations.services import ProjectCalculator
         calculator = ProjectCalculator()
-        breakdown = calculator.get_budget_breakdown(project)
+        with self.start_trace(request, calculator):
+            project = self.get_object()
+            breakdown = calculator.get_budget_breakdown(project)
         data = {
             'project_id': project.id,
             'project_name': project.name,
@@ -239,8 +565,32 @@ class ProjectViewSet(viewsets.ModelViewSet):
             'total_cost_morocco': getattr(project, 'total_cost_morocco', 0) or 0,
             'budget_breakdown': breakdown,
         }
+        self.finish_trace(request, calculator, data, 'budget', project)
         return Response(data)
 
+    @action(detail=False, methods=['get'], url_path='calculation-traces')
+    def calculation_traces(self, request):
+        """Latest logged calculation traces (admins only), optionally filtered by ?project=<id>"""
+        if not IsAdminOrSuperAdmin().has_permission(request, self):
+            return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
+        from calculations.models import CalculationTrace
+        traces = CalculationTrace.objects.all()
+        if request.query_params.get('project'):
+            traces = traces.filter(project_id=request.query_params['project'])
+        return Response([
+            {
+                'id': trace.id,
+                'project_id': trace.project_id,
+                'action': trace.action,
+                'total_ms': trace.total_ms,
+                'query_count': trace.query_count,
+                'query_ms': trace.query_ms,
+                'stages': trace.stages,
+                'created_at': trace.created_at,
+            }
+            for trace in traces[:100]
+        ])
+
     @action(detail=True, methods=['get'], url_path='financial-details')
     def financial_details(self, request, pk=None):
         """
@@ -253,8 +603,8 @@ class ProjectViewSet(viewsets.ModelViewSet):
         breakdown = calculator.get_budget_breakdown(project)
         
         # Calculate totals
-        total_france = sum(cat['total_france'] for cat in breakdown.values())
-        total_morocco = sum(cat['total_morocco'] for cat in breakdown.values())
+        total_france = sum((Decimal(str(cat['total_france'])) for cat in breakdown.values()), Decimal('0'))
+        total_morocco = sum((Decimal(str(cat['total_morocco'])) for cat in breakdown.values()), Decimal('0'))
         total_items = sum(len(cat['items']) for cat in breakdown.values())
         
         # Calculate cost per user